@@ -0,0 +1,145 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import tracemalloc
+
+from predictors import methods, build_predictor
+from prediction_elements import get_stats
+from trace_io import open_trace, np
+from benchmarks.synthetic import KINDS, write_trace
+
+# Times every prediction method on a synthetic trace and compares the result
+# with a stored baseline. Speed is the best of -repeat runs without memory
+# tracing; peak memory comes from one more run under tracemalloc, which is
+# several times slower. TAGE's replacement is seeded, so the prediction
+# counts of a configuration are exact and any change is reported.
+
+def run_once(config, trace_path, engine, seed):
+    random.seed(seed)
+    bp = build_predictor(*config)
+    with open_trace(trace_path) as trace:
+        start = time.perf_counter()
+        if engine == 'numpy':
+            for pcs, outcomes in trace.blocks():
+                bp.predict_batch(pcs, outcomes)
+        else:
+            for pc, branch in trace:
+                bp.predict(pc, branch)
+        seconds = time.perf_counter() - start
+    return bp, seconds
+
+def benchmark(config, trace_path, engine, seed, repeat):
+    seconds = min(run_once(config, trace_path, engine, seed)[1] for _ in range(repeat))
+
+    tracemalloc.start()
+    bp, _ = run_once(config, trace_path, engine, seed)
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    result = get_stats(bp)
+    result['seconds'] = seconds
+    result['branches_per_second'] = result['total'] / seconds
+    result['ns_per_branch'] = seconds / result['total'] * 1e9
+    result['peak_memory'] = peak_memory
+    return result
+
+def config_key(result):
+    return result['method'], result['counter_bits'], result['counter_init'], result['pht_entries']
+
+def compare(results, baseline, tolerance):
+    # Returns the number of speed regressions and accuracy changes
+    previous = {config_key(result): result for result in baseline['results']}
+    problems = 0
+    row = "{:<22}{:>8}{:>16}{:>16}{:>10}  {}"
+    print(row.format("Type", "PHT", "Branches/s", "Baseline", "Change", ""))
+    for result in results:
+        old = previous.get(config_key(result))
+        if old is None:
+            print(row.format(result['method'], result['pht_entries'], '{0:.0f}'.format(result['branches_per_second']),
+                             "-", "-", "new"))
+            continue
+        change = result['branches_per_second'] / old['branches_per_second'] - 1
+        notes = []
+        if change < -tolerance:
+            notes.append("SLOWER")
+        if (result['mispredictions'], result['no_predictions']) != (old['mispredictions'], old['no_predictions']):
+            notes.append("ACCURACY CHANGED: MP/KI {0:.04f} -> {1:.04f}".format(old['mpki'], result['mpki']))
+        problems += len(notes)
+        print(row.format(result['method'], result['pht_entries'], '{0:.0f}'.format(result['branches_per_second']),
+                         '{0:.0f}'.format(old['branches_per_second']), '{0:+.01%}'.format(change), " ".join(notes)))
+    print()
+    return problems
+
+def print_results(results):
+    row = "{:<22}{:>8}{:>16}{:>12}{:>14}{:>12}"
+    print(row.format("Type", "PHT", "Branches/s", "ns/branch", "Peak memory", "MP/KI"))
+    for result in results:
+        print(row.format(result['method'], result['pht_entries'], '{0:.0f}'.format(result['branches_per_second']),
+                         '{0:.0f}'.format(result['ns_per_branch']),
+                         '{0:.01f} KiB'.format(result['peak_memory'] / 1024), '{0:.04f}'.format(result['mpki'])))
+    print()
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark every prediction method on a synthetic trace")
+    parser.add_argument("-methods", help="Prediction methods",nargs='+',choices=list(methods),default=list(methods),
+            required=False)
+    parser.add_argument("-phtsize", help="Pattern history table sizes",nargs='+',default=[1024, 16384],type=int,
+            required=False)
+    parser.add_argument("-cbits", help="How many bits for the state counters",default=2,type=int,required=False)
+    parser.add_argument("-branches", help="Synthetic trace length",default=100000,type=int,required=False)
+    parser.add_argument("-seed", help="Seed of the synthetic trace and of TAGE's replacement",default=0,type=int,
+            required=False)
+    parser.add_argument("-kinds", help="Branch behaviours in the synthetic trace",nargs='+',choices=KINDS,
+            default=KINDS,required=False)
+    parser.add_argument("-engine", help="Simulation engine",choices=['python', 'numpy'],default='python',
+            required=False)
+    parser.add_argument("-repeat", help="Timed runs per configuration; the fastest counts",default=3,type=int,
+            required=False)
+    parser.add_argument("-baseline", help="Compare with the results in this JSON file",required=False)
+    parser.add_argument("-tolerance", help="Slowdown against the baseline reported as a regression, in percent",
+            default=10.0,type=float,required=False)
+    parser.add_argument("-save", help="Write the results to this JSON file, to be used as a baseline",required=False)
+    args = parser.parse_args()
+    if args.engine == 'numpy' and np is None:
+        parser.error("-engine numpy requires NumPy")
+    if args.repeat < 1:
+        parser.error("-repeat must be positive")
+
+    trace_info = {'branches': args.branches, 'seed': args.seed, 'kinds': args.kinds}
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline['trace'] != trace_info or baseline['engine'] != args.engine:
+            parser.error("{} was recorded on a different trace or engine: {} {}".format(
+                args.baseline, baseline['trace'], baseline['engine']))
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        trace_path = os.path.join(directory, "synthetic.txt")
+        write_trace(trace_path, args.branches, args.seed, args.kinds)
+        for method in args.methods:
+            for pht_size in args.phtsize:
+                print("Benchmarking", method, pht_size, "...")
+                results.append(benchmark((method, args.cbits, 0, pht_size), trace_path, args.engine,
+                                         args.seed, args.repeat))
+    print()
+    print_results(results)
+
+    if args.save is not None:
+        with open(args.save, 'w') as save_file:
+            json.dump({'trace': trace_info, 'engine': args.engine, 'python': platform.python_version(),
+                       'results': results}, save_file, indent=4)
+
+    if baseline is not None and compare(results, baseline, args.tolerance / 100):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/python3
+
+import random
+import argparse
+from itertools import islice
+
+# Deterministic synthetic traces. A program of static branches is laid out
+# once from the seed, each branch with one behaviour, and then walked in
+# program order until enough records are produced:
+#
+#   loops       a loop closing branch: taken trip count - 1 times, then not taken
+#   biased      taken with a fixed probability close to 0 or 1
+#   correlated  the parity of a few of the most recent global outcomes
+#   random      taken with probability 1/2
+#
+# The same seed, kinds and branch count always give the same trace.
+KINDS = ['loops', 'biased', 'correlated', 'random']
+CODE_BASE = 0x400000
+HISTORY_BITS = 16
+
+class SyntheticProgram:
+    def __init__(self, seed=0, kinds=KINDS, num_branches=256):
+        self.rng = random.Random(seed)
+        self.branches = []
+        pc = CODE_BASE
+        for index in range(num_branches):
+            pc += 4 * self.rng.randint(1, 16)
+            kind = kinds[index % len(kinds)]
+            if kind == 'loops':
+                parameter = self.rng.randint(2, 24)
+            elif kind == 'biased':
+                parameter = self.rng.choice([0.02, 0.1, 0.9, 0.98])
+            elif kind == 'correlated':
+                parameter = 0
+                for distance in self.rng.sample(range(HISTORY_BITS), self.rng.randint(1, 3)):
+                    parameter |= 1 << distance
+            else:
+                parameter = 0.5
+            self.branches.append((pc, kind, parameter))
+
+    def __iter__(self):
+        # Yields (pc, outcome) forever
+        rng = self.rng
+        history = 0
+        history_mask = 2**HISTORY_BITS - 1
+        while True:
+            for pc, kind, parameter in self.branches:
+                if kind == 'loops':
+                    outcomes = [1] * (parameter - 1) + [0]
+                elif kind == 'correlated':
+                    outcomes = [bin(history & parameter).count('1') & 1]
+                else:
+                    outcomes = [1 if rng.random() < parameter else 0]
+                for outcome in outcomes:
+                    history = ((history << 1) | outcome) & history_mask
+                    yield pc, outcome
+
+def generate(count, seed=0, kinds=KINDS, num_branches=256):
+    return islice(SyntheticProgram(seed, kinds, num_branches), count)
+
+def write_trace(path, count, seed=0, kinds=KINDS, num_branches=256):
+    with open(path, 'w') as trace:
+        for pc, outcome in generate(count, seed, kinds, num_branches):
+            trace.write("{} {}\n".format(pc, 'T' if outcome else 'N'))
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a deterministic synthetic trace in the text format")
+    parser.add_argument("output", help="Output trace file")
+    parser.add_argument("-branches", help="Number of trace records",default=1000000,type=int,required=False)
+    parser.add_argument("-seed", help="Seed of the synthetic program",default=0,type=int,required=False)
+    parser.add_argument("-kinds", help="Branch behaviours to mix",nargs='+',choices=KINDS,default=KINDS,required=False)
+    parser.add_argument("-static", help="Number of static branches",default=256,type=int,required=False)
+    args = parser.parse_args()
+
+    write_trace(args.output, args.branches, args.seed, args.kinds, args.static)
+
+if __name__ == "__main__":
+    main()
@@ -1,46 +1,311 @@
 #!/usr/bin/python3
 
-import sys
+import os
+import json
 import argparse
 
 from predictors import *
 from prediction_elements import *
+from trace_io import open_trace, SharedTrace, np
+from parallel import run_pool, chunk_bounds
+from checkpoint import save_checkpoint, load_checkpoint
+from sampling import simulate_sampled, sample_stats, print_sample_stats
+from branch_profile import BranchProfile, print_profile, save_profile
+from interval_stats import IntervalRecorder
+from instrumentation import Throughput, StageProfiler
+
+def parse_config(text):
+    # method:phtsize[:cbits[:cinit]]
+    fields = text.split(":")
+    if len(fields) < 2 or len(fields) > 4 or fields[0] not in methods:
+        raise argparse.ArgumentTypeError("expected method:phtsize[:cbits[:cinit]], got '{}'".format(text))
+    try:
+        numbers = [int(field) for field in fields[1:]]
+    except ValueError:
+        raise argparse.ArgumentTypeError("non-integer field in '{}'".format(text))
+    pht_size, num_state_bits, init_state_val = (numbers + [2, 0][len(numbers) - 1:])[:3]
+    return fields[0], num_state_bits, init_state_val, pht_size
+
+def read_configs(path):
+    with open(path) as config_file:
+        return [parse_config(line.strip()) for line in config_file
+                if line.strip() and not line.startswith("#")]
+
+def simulate(trace, predictors, engine='python', start=0, checkpoint_every=0, checkpoint=None,
+             interval=0, recorder=None):
+    # Every trace record is decoded once and fed to all predictors. start is
+    # the trace offset of the first record; checkpoint(offset) is called
+    # every checkpoint_every branches and recorder.record(offset) every
+    # interval branches. Returns the offset after the last record.
+    next_checkpoint = (start // checkpoint_every + 1) * checkpoint_every if checkpoint_every else -1
+    next_interval = (start // interval + 1) * interval if interval else -1
+    throughput = Throughput(trace, start)
+    if engine == 'numpy':
+        index = start
+        for pcs, outcomes in trace.blocks():
+            throughput.report(index)
+            # Blocks are split at interval boundaries
+            first = 0
+            while first < len(pcs):
+                last = len(pcs) if next_interval < 0 else min(len(pcs), first + next_interval - index)
+                for bp in predictors:
+                    bp.predict_batch(pcs[first:last], outcomes[first:last])
+                index += last - first
+                first = last
+                if index == next_interval:
+                    recorder.record(index)
+                    next_interval += interval
+            if 0 <= next_checkpoint <= index:
+                checkpoint(index)
+                next_checkpoint = (index // checkpoint_every + 1) * checkpoint_every
+        throughput.finish(index)
+        return index
+
+    index = start - 1
+    if len(predictors) == 1:
+        bp = predictors[0]
+        for index,(pc, branch) in enumerate(trace, start):
+            if index % 10000 == 0:
+                throughput.report(index)
+            if index == next_checkpoint:
+                checkpoint(index)
+                next_checkpoint += checkpoint_every
+            if index == next_interval:
+                recorder.record(index)
+                next_interval += interval
+
+            bp.predict(pc, branch)
+    else:
+        for index,(pc, branch) in enumerate(trace, start):
+            if index % 10000 == 0:
+                throughput.report(index)
+            if index == next_interval:
+                recorder.record(index)
+                next_interval += interval
+
+            pc = int(pc)
+            for bp in predictors:
+                bp.predict(pc, branch)
+    throughput.finish(index + 1)
+    return index + 1
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument("-method", help="Prediction method", choices=[ 
-        'one-level','two-level-global','gshare','two-level-local', 'tournament', 'tage'],required=True)
+    parser.add_argument("-method", help="Prediction method", choices=list(methods),required=False)
     parser.add_argument("-cbits", help="How many bits for the state counters",default=2,type=int,required=False)
     parser.add_argument("-cinit", help="Initial state counter value",default=0,type=int,required=False)
-    parser.add_argument("-phtsize", help="Number of pattern history table entries",type=int,required=True)
-    parser.add_argument("-trace", help="Input trace file",required=True)
+    parser.add_argument("-phtsize", help="Number of pattern history table entries",type=int,required=False)
+    parser.add_argument("-config", help="Simulate an additional configuration method:phtsize[:cbits[:cinit]] "
+            "in the same pass over the trace (repeatable)",action='append',type=parse_config,default=[],required=False)
+    parser.add_argument("-configs", help="File with one method:phtsize[:cbits[:cinit]] configuration per line",required=False)
+    parser.add_argument("-json", help="Write the results of all configurations to this JSON file",required=False)
+    parser.add_argument("-trace", help="Input trace file: text (optionally .gz/.xz/.bz2), packed binary, or - for stdin",required=True)
+    parser.add_argument("-engine", help="Simulation engine; numpy replays one-level, two-level-global, gshare and perceptron in bulk",
+            choices=['python', 'numpy'],default='python',required=False)
+    parser.add_argument("-sparse", help="Allocate pattern history table entries on first write, for very large tables",
+            action='store_true',required=False)
+    parser.add_argument("-checkpoint", help="Save a predictor snapshot to this file at the end of the run",required=False)
+    parser.add_argument("-checkpoint-every", help="Also save the snapshot every N branches",
+            dest='checkpoint_every',default=0,type=int,required=False)
+    parser.add_argument("-resume", help="Continue the run saved in this snapshot, from its trace offset",required=False)
+    parser.add_argument("-warm-from", help="Start from the predictor state in this snapshot, with fresh stats",
+            dest='warm_from',required=False)
+    parser.add_argument("-skip", help="Start simulating at this trace offset",default=0,type=int,required=False)
+    parser.add_argument("-sample-period", help="Sampled simulation: measure one detailed window per this many branches",
+            dest='sample_period',default=0,type=int,required=False)
+    parser.add_argument("-sample-warmup", help="Branches simulated without stats before each detailed window",
+            dest='sample_warmup',default=10000,type=int,required=False)
+    parser.add_argument("-sample-detail", help="Branches measured in each detailed window",
+            dest='sample_detail',default=10000,type=int,required=False)
+    parser.add_argument("-sample-ff", help="Fast-forward between windows by training the predictor (warm) or skipping branches (skip)",
+            dest='sample_ff',choices=['warm', 'skip'],default='warm',required=False)
+    parser.add_argument("-sample-placement", help="Place the windows at the end of each period or at a random offset",
+            dest='sample_placement',choices=['fixed', 'random'],default='fixed',required=False)
+    parser.add_argument("-sample-seed", help="Seed for random window placement",
+            dest='sample_seed',default=0,type=int,required=False)
+    parser.add_argument("-chunks", help="Split the trace into this many chunks simulated in parallel from cold "
+            "predictor state",default=1,type=int,required=False)
+    parser.add_argument("-warmup", help="Branches before each chunk replayed without stats to warm up its predictor",
+            default=100000,type=int,required=False)
+    parser.add_argument("-jobs", help="Worker processes for -chunks",default=os.cpu_count(),type=int,required=False)
+    parser.add_argument("-verify", help="With -chunks, also run an exact serial simulation and report the error",
+            action='store_true',required=False)
+    parser.add_argument("-profile-top", help="Profile every static branch and list the N with the most mispredictions",
+            dest='profile_top',default=0,type=int,required=False)
+    parser.add_argument("-profile-out", help="Write the per-branch profile to this .csv or .npz file",
+            dest='profile_out',required=False)
+    parser.add_argument("-interval", help="Write stats for every N branches to the -interval-out file",
+            default=0,type=int,required=False)
+    parser.add_argument("-interval-out", help="Interval stats file: .csv, or JSON lines for any other name",
+            dest='interval_out',required=False)
+    parser.add_argument("-stage-profile", help="Report the time spent in each simulation stage (slows the run down)",
+            dest='stage_profile',action='store_true',required=False)
+    parser.add_argument("-histlen", help="Global history length of the perceptron predictor",
+            type=int,required=False)
     args = parser.parse_args()
+    if args.chunks < 1 or args.warmup < 0:
+        parser.error("-chunks must be positive and -warmup non-negative")
+    if args.engine == 'numpy' and np is None:
+        parser.error("-engine numpy requires NumPy")
+    if args.histlen is not None and args.histlen < 1:
+        parser.error("-histlen must be positive")
 
-    methods = {
-            'one-level':        OneLevel,
-            'two-level-global': TwoLevelGlobal,
-            'gshare':           GShare,
-            'two-level-local':  TwoLevelLocal,
-            'tournament':       TournamentPredictor,
-            'tage':             TAGEPredictor
-            }
-
-    bp = methods[args.method](args.cbits, args.cinit, args.phtsize)
-
-    with open(args.trace) as trace:
-        print("Simulating...\n")
-        trace = list(trace)
-        for index,request in enumerate(trace):
-            if index % 10000 == 0:
-                sys.stdout.write('\r')
-                sys.stdout.write(str( '{0:.0f}'.format(index / len(trace) * 100)) + "% complete")
-                sys.stdout.flush()
+    configs = []
+    if args.method is not None:
+        if args.phtsize is None:
+            parser.error("-method requires -phtsize")
+        configs.append((args.method, args.cbits, args.cinit, args.phtsize))
+    configs += args.config
+    if args.configs is not None:
+        try:
+            configs += read_configs(args.configs)
+        except argparse.ArgumentTypeError as error:
+            parser.error("{}: {}".format(args.configs, error))
+    snapshot = args.resume or args.warm_from
+    if args.resume and args.warm_from:
+        parser.error("-resume and -warm-from are exclusive")
+    if snapshot and configs:
+        parser.error("the configuration of -resume and -warm-from comes from the snapshot")
+    if not configs and not snapshot:
+        parser.error("give -method and -phtsize, -config or -configs")
+    if np is None and any(config[0] == 'perceptron' for config in configs):
+        parser.error("the perceptron predictor requires NumPy")
+    if (args.checkpoint or snapshot) and (len(configs) > 1 or args.chunks > 1):
+        parser.error("snapshots need a single configuration and no -chunks")
+    if args.checkpoint_every and not args.checkpoint:
+        parser.error("-checkpoint-every requires -checkpoint")
+    if args.sample_period:
+        if len(configs) != 1 or snapshot or args.checkpoint or args.chunks > 1:
+            parser.error("sampled simulation needs a single configuration without snapshots or -chunks")
+        if args.sample_detail < 1 or args.sample_warmup < 0 or \
+                args.sample_period < args.sample_warmup + args.sample_detail:
+            parser.error("-sample-period must cover -sample-warmup plus a positive -sample-detail")
+    if (args.interval > 0) != (args.interval_out is not None) or args.interval < 0:
+        parser.error("-interval N needs a positive N and -interval-out")
+    if args.interval and (args.sample_period or args.chunks > 1):
+        parser.error("interval stats need a plain serial simulation")
+    if args.stage_profile and (args.engine != 'python' or args.sample_period or args.chunks > 1 or args.checkpoint):
+        parser.error("-stage-profile needs a plain serial simulation with -engine python and no -checkpoint")
+    profiling = args.profile_top > 0 or args.profile_out is not None
+    if profiling and (args.sample_period or args.chunks > 1):
+        parser.error("per-branch profiles need a plain serial simulation")
+    if args.profile_out is not None:
+        if len(configs) > 1:
+            parser.error("-profile-out needs a single configuration")
+        if not args.profile_out.endswith((".csv", ".npz")):
+            parser.error("-profile-out must name a .csv or .npz file")
+        if args.profile_out.endswith(".npz") and np is None:
+            parser.error(".npz profiles require NumPy")
+
+    if args.sample_period:
+        results = [simulate_sampling(args, configs[0])]
+    elif args.chunks > 1:
+        results = simulate_chunked(args, configs)
+    else:
+        start = args.skip
+        if args.resume:
+            bp, start = load_checkpoint(args.resume)
+            predictors = [bp]
+        elif args.warm_from:
+            bp, _ = load_checkpoint(args.warm_from)
+            reset_stats(bp)
+            bp.profile = None
+            predictors = [bp]
+        else:
+            predictors = [build_predictor(*config, sparse=args.sparse, history_length=args.histlen)
+                          for config in configs]
+        # A resumed run carries on with the profile saved in its snapshot
+        for bp in predictors:
+            if profiling and bp.profile is None:
+                bp.profile = BranchProfile()
+
+        def checkpoint(offset):
+            save_checkpoint(args.checkpoint, predictors[0], offset)
+
+        recorder = IntervalRecorder(args.interval_out, predictors, start) if args.interval else None
+        stage_profiler = StageProfiler() if args.stage_profile else None
+        with open_trace(args.trace) as trace:
+            print("Simulating...\n")
+            trace.skip(start)
+            if stage_profiler is not None:
+                stage_profiler.attach(predictors)
+                trace = stage_profiler.trace(trace)
+            end = simulate(trace, predictors, args.engine, start, args.checkpoint_every, checkpoint,
+                           args.interval, recorder)
+            if stage_profiler is not None:
+                stage_profiler.detach()
+        if recorder is not None:
+            recorder.record(end)
+            recorder.close()
+        if args.checkpoint:
+            checkpoint(end)
+
+        results = [get_stats(bp) for bp in predictors]
+        if len(predictors) == 1:
+            print_stats(predictors[0])
+            #predictors[0].print_debug_stats()
+        else:
+            print_stats_table(results)
+
+        if stage_profiler is not None:
+            stage_profiler.report(end - start)
+        if args.profile_top > 0:
+            for bp in predictors:
+                if len(predictors) > 1:
+                    print(bp.get_method_type(), bp.num_state_bits, bp.init_state_val, bp.pht_size)
+                print_profile(bp.profile, args.profile_top)
+        if args.profile_out is not None:
+            save_profile(predictors[0].profile, args.profile_out)
+
+    if args.json is not None:
+        with open(args.json, 'w') as json_file:
+            json.dump(results, json_file, indent=4)
+
+def simulate_sampling(args, config):
+    bp = build_predictor(*config, sparse=args.sparse, history_length=args.histlen)
+    with open_trace(args.trace) as trace:
+        print("Simulating (sampled)...\n")
+        samples = simulate_sampled(trace, bp, args.sample_period, args.sample_warmup, args.sample_detail,
+                                   args.sample_ff, args.sample_placement, args.engine, args.sample_seed)
+
+    stats = sample_stats(bp, samples)
+    print_sample_stats(stats)
+    return stats
+
+def simulate_chunked(args, configs):
+    # Chunks start from cold predictors warmed up on the tail of the previous
+    # chunk, so the merged counts approximate a serial run
+    with SharedTrace.create(args.trace) as trace:
+        print("Simulating", args.chunks, "chunks...\n")
+        bounds = chunk_bounds(len(trace), args.chunks)
+        tasks = [(config, start, end, args.warmup, args.engine, None, args.sparse, args.histlen)
+                 for config in configs for start, end in bounds]
+        if args.verify:
+            tasks += [(config, 0, len(trace), 0, args.engine, None, args.sparse, args.histlen)
+                      for config in configs]
+        chunk_results = run_pool(trace, tasks, args.jobs)
+
+    results = [merge_stats(chunk_results[index * args.chunks:(index + 1) * args.chunks])
+               for index in range(len(configs))]
+    if len(results) == 1:
+        print_stats_summary(results[0])
+    else:
+        print_stats_table(results)
 
-            pc, branch = request.split(" ")
-            bp.predict(pc, norm_branch(branch))
+    print("Chunked simulation:", args.chunks, "chunks,", args.warmup, "warmup branches per chunk")
+    if not args.verify:
+        print("Run with -verify to measure the error against a serial simulation\n")
+        return results
 
-    print_stats(bp)
-    #bp.print_debug_stats()
+    for stats, serial in zip(results, chunk_results[len(configs) * args.chunks:]):
+        error = stats['mispredictions'] + stats['no_predictions'] - serial['mispredictions'] - serial['no_predictions']
+        stats['serial_mpki'] = serial['mpki']
+        stats['mpki_error'] = stats['mpki'] - serial['mpki']
+        print(stats['method'], stats['counter_bits'], stats['counter_init'], stats['pht_entries'],
+              "\tvs serial: {0:+d} mispredictions + no predictions, MP/KI {1:.04f} vs {2:.04f} ({3:+.04f})".format(
+                  error, stats['mpki'], serial['mpki'], stats['mpki_error']))
+    print()
+    return results
 
 if __name__ == "__main__":
     main()
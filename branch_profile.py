@@ -0,0 +1,110 @@
+import csv
+from array import array
+from collections import Counter
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Branches a profile buffers before counting them
+PROFILE_BUFFER = 64 * 1024
+
+class BranchProfile:
+    # Per static branch execution, misprediction and no-prediction counts.
+    # Each PC gets a dense slot the first time it is counted; the counts live
+    # in flat arrays indexed by slot. predict only appends the PC to the
+    # pending lists of executed and of mispredicted or unpredicted branches,
+    # and flush() counts them in bulk once PROFILE_BUFFER are pending.
+    def __init__(self):
+        self.slots = {}
+        self.pcs = array('Q')
+        self.executions = array('Q')
+        self.mispredictions = array('Q')
+        self.no_predictions = array('Q')
+        self.executed = []
+        self.missed = []
+        self.unpredicted = []
+
+    def __len__(self):
+        self.flush()
+        return len(self.pcs)
+
+    def slot(self, pc):
+        # Text traces give PCs as strings and binary ones as ints; both
+        # spellings of a PC share one slot
+        key = int(pc)
+        slot = self.slots.get(key)
+        if slot is None:
+            slot = len(self.pcs)
+            self.slots[key] = slot
+            self.pcs.append(key)
+            self.executions.append(0)
+            self.mispredictions.append(0)
+            self.no_predictions.append(0)
+        self.slots[pc] = slot
+        return slot
+
+    def flush(self):
+        for counts, pending in ((self.executions, self.executed),
+                                (self.mispredictions, self.missed),
+                                (self.no_predictions, self.unpredicted)):
+            if not pending:
+                continue
+            for pc, count in tally(pending):
+                counts[self.slot(pc)] += count
+            pending.clear()
+
+    def record_batch(self, pcs, predictions, outcomes):
+        # predictions as returned by batch_predictions, -1 for no prediction
+        unique, inverse = np.unique(pcs, return_inverse=True)
+        slots = np.array([self.slot(pc) for pc in unique.tolist()], dtype=np.intp)[inverse]
+        no_prediction = predictions == -1
+        missed = (predictions != outcomes) & ~no_prediction
+        for counts, selected in ((self.executions, slots),
+                                 (self.no_predictions, slots[no_prediction]),
+                                 (self.mispredictions, slots[missed])):
+            np.frombuffer(counts, dtype=np.uint64)[:] += \
+                    np.bincount(selected, minlength=len(self.pcs)).astype(np.uint64)
+
+    def rows(self):
+        # (pc, executions, mispredictions, no predictions) per static branch
+        self.flush()
+        return list(zip(self.pcs, self.executions, self.mispredictions, self.no_predictions))
+
+    def top(self, count):
+        # The count branches with the most mispredictions plus no predictions
+        return sorted(self.rows(), key=lambda row: (-(row[2] + row[3]), row[0]))[:count]
+
+def tally(pcs):
+    # (pc, occurrences) of every distinct PC
+    if np is None:
+        return Counter(pcs).items()
+    # Without a dtype, NumPy would turn PCs from 2**63 up into floats
+    unique, counts = np.unique(np.array(pcs, dtype=None if isinstance(pcs[0], str) else np.uint64),
+                               return_counts=True)
+    return zip(unique.tolist(), counts.tolist())
+
+def print_profile(profile, count):
+    print("Static branches:\t", len(profile))
+    print("Top", count, "branches by mispredictions + no predictions:")
+    print("PC\t\t\t", "Executed\t", "Mispredicted\t", "No prediction\t", "Miss rate")
+    for pc, executions, mispredictions, no_predictions in profile.top(count):
+        print('{0:#018x}'.format(pc), "\t", executions, "\t\t", mispredictions, "\t\t", no_predictions, "\t\t",
+              '{0:.02f}'.format((mispredictions + no_predictions) / executions * 100), "%")
+    print()
+
+def save_profile(profile, path):
+    # .npz (NumPy) or .csv, by extension
+    profile.flush()
+    if path.endswith(".npz"):
+        np.savez(path,
+                 pc=np.frombuffer(profile.pcs, dtype=np.uint64),
+                 executions=np.frombuffer(profile.executions, dtype=np.uint64),
+                 mispredictions=np.frombuffer(profile.mispredictions, dtype=np.uint64),
+                 no_predictions=np.frombuffer(profile.no_predictions, dtype=np.uint64))
+        return
+    with open(path, 'w', newline='') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(['pc', 'executions', 'mispredictions', 'no_predictions'])
+        writer.writerows(profile.rows())
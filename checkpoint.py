@@ -0,0 +1,42 @@
+import os
+import zlib
+import pickle
+import random
+
+# Predictor snapshots: a magic line followed by a zlib-compressed pickle of
+# the predictor (tables, histories, TAGE tags and useful bits, count and
+# msb_flip, stats counters), the trace offset it has simulated up to and the
+# state of the random module, which TAGE replacement draws from. Snapshots
+# are pickles, so only load ones you wrote yourself.
+
+CHECKPOINT_MAGIC = b"BPCKPT1\n"
+
+def snapshot(predictor, trace_offset=0):
+    state = {
+            'predictor':    predictor,
+            'trace_offset': trace_offset,
+            'random_state': random.getstate()
+            }
+    return CHECKPOINT_MAGIC + zlib.compress(pickle.dumps(state, pickle.HIGHEST_PROTOCOL))
+
+def restore(data, restore_random=True):
+    # Returns (predictor, trace_offset) and, unless told not to, restores the
+    # random module
+    if not data.startswith(CHECKPOINT_MAGIC):
+        raise ValueError("not a predictor checkpoint")
+    state = pickle.loads(zlib.decompress(data[len(CHECKPOINT_MAGIC):]))
+    if restore_random:
+        random.setstate(state['random_state'])
+    return state['predictor'], state['trace_offset']
+
+def save_checkpoint(path, predictor, trace_offset):
+    # Written next to the target and renamed over it, so a crash mid-write
+    # leaves the previous checkpoint intact
+    temp_path = path + ".tmp"
+    with open(temp_path, 'wb') as checkpoint_file:
+        checkpoint_file.write(snapshot(predictor, trace_offset))
+    os.replace(temp_path, path)
+
+def load_checkpoint(path):
+    with open(path, 'rb') as checkpoint_file:
+        return restore(checkpoint_file.read())
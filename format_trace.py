@@ -1,30 +1,89 @@
 #!/usr/bin/python3
 
-import sys
+import io
+import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 
-def main():
-    trace_list = []
-    with open('branches_0.out','r') as trace:
-        print("Normalizing...\n")
-        for request in trace:
+from trace_io import decompressing_stream, BinaryTraceWriter, TextTraceWriter, BINARY_BLOCK_SIZE
+
+# Fields of a PIN branch extractor record (whitespace separated)
+TAKEN_FIELD = 1
+CONDITIONAL_FIELD = 2
+PC_FIELD = 7
+
+# Dropped from input names, as the outputs are not compressed
+COMPRESSED_SUFFIXES = ('.gz', '.xz', '.bz2')
+
+def convert(input_path, output_path, output_format='text', pc_min=0, pc_max=None, block_size=BINARY_BLOCK_SIZE):
+    # Streams the conditional branches of one extractor output with a PC in
+    # [pc_min, pc_max) to a text or packed binary trace. The input may be
+    # gzip, xz or bzip2 compressed. Returns (records read, branches written).
+    if output_format == 'binary':
+        writer = BinaryTraceWriter(output_path, block_size)
+    else:
+        writer = TextTraceWriter(output_path)
+
+    records = 0
+    with open(input_path, 'rb') as raw, writer:
+        for request in io.TextIOWrapper(decompressing_stream(raw)):
+            records += 1
             temp = request.split()
-            taken = temp[1]
-            cond = temp[2]
-            PC =  temp[7]
-            if cond is '1':
-                if taken is '1':
-                    taken_str = 'T'
-                else:
-                    taken_str = 'N'
-
-                trace_list.append(str(int(PC, 16)) + " " + taken_str)
-
-    with open('normed-branches.out','w') as trace:
-        print("Printing...\n")
-        for branch in trace_list:
-            trace.write(branch)
-            trace.write("\n")
+            if temp[CONDITIONAL_FIELD] != '1':
+                continue
+            pc = int(temp[PC_FIELD], 16)
+            if pc < pc_min or (pc_max is not None and pc >= pc_max):
+                continue
+            writer.write(pc, temp[TAKEN_FIELD] == '1')
+    return records, writer.length
+
+def output_path_for(input_path, output_dir):
+    directory, name = os.path.split(input_path)
+    if name.endswith(COMPRESSED_SUFFIXES):
+        name = os.path.splitext(name)[0]
+    return os.path.join(output_dir if output_dir is not None else directory, "normed-" + name)
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract the conditional branches of PIN branch extractor "
+                                                 "outputs into traces")
+    parser.add_argument("inputs", help="Extractor outputs (optionally .gz/.xz/.bz2)",nargs='*',default=['branches_0.out'])
+    parser.add_argument("-output", help="Output trace for a single input",default=None,required=False)
+    parser.add_argument("-outdir", help="Directory for the normed-<input> traces of several inputs "
+            "(default: next to each input)",required=False)
+    parser.add_argument("-format", help="Output trace format",choices=['text', 'binary'],default='text',required=False)
+    parser.add_argument("-blocksize", help="Records per block of a binary trace (multiple of 8)",
+            default=BINARY_BLOCK_SIZE,type=int,required=False)
+    parser.add_argument("-pc-min", help="Keep only branches at or above this PC (decimal or 0x hex)",
+            dest='pc_min',default=0,type=lambda text: int(text, 0),required=False)
+    parser.add_argument("-pc-max", help="Keep only branches below this PC (decimal or 0x hex)",
+            dest='pc_max',default=None,type=lambda text: int(text, 0),required=False)
+    parser.add_argument("-jobs", help="Inputs converted in parallel",default=os.cpu_count(),type=int,required=False)
+    args = parser.parse_args()
+    if args.output is not None and len(args.inputs) > 1:
+        parser.error("-output takes a single input; use -outdir for several")
+    if args.blocksize == 0 or args.blocksize % 8 != 0:
+        parser.error("-blocksize must be a non-zero multiple of 8")
+    if args.outdir is not None:
+        try:
+            os.makedirs(args.outdir, exist_ok=True)
+        except OSError as error:
+            parser.error("cannot create -outdir: {}".format(error))
+
+    if args.output is not None:
+        outputs = [args.output]
+    elif args.inputs == ['branches_0.out'] and args.outdir is None:
+        outputs = ['normed-branches.out']
+    else:
+        outputs = [output_path_for(path, args.outdir) for path in args.inputs]
+
+    print("Normalizing", len(args.inputs), "file(s)...\n")
+    with ProcessPoolExecutor(max_workers=max(1, min(args.jobs, len(args.inputs)))) as pool:
+        futures = [pool.submit(convert, input_path, output_path, args.format, args.pc_min, args.pc_max,
+                               args.blocksize)
+                   for input_path, output_path in zip(args.inputs, outputs)]
+        for input_path, output_path, future in zip(args.inputs, outputs, futures):
+            records, branches = future.result()
+            print(input_path, "->", output_path + ":", records, "records,", branches, "branches written")
 
 if __name__ == "__main__":
     main()
-
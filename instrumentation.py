@@ -0,0 +1,216 @@
+import sys
+import time
+from collections import defaultdict
+
+import predictors
+import prediction_elements
+from prediction_elements import TaggedTable, FoldedHistory
+
+# Minimum time between two progress line updates
+PROGRESS_REFRESH = 0.25
+
+class Throughput:
+    # Branches per second, ns per branch and ETA of a running simulation.
+    # report() is cheap to call often; the progress line is only redrawn
+    # every PROGRESS_REFRESH seconds.
+    def __init__(self, trace, start=0):
+        self.trace = trace
+        self.start = start
+        self.index = start
+        self.first_progress = trace.progress() or 0.0
+        self.started = time.perf_counter()
+        self.last_draw = self.started
+
+    def report(self, index):
+        self.index = index
+        now = time.perf_counter()
+        if now - self.last_draw < PROGRESS_REFRESH:
+            return
+        self.last_draw = now
+        sys.stdout.write('\r' + self.status(now) + '   ')
+        sys.stdout.flush()
+
+    def status(self, now):
+        elapsed = now - self.started
+        progress = self.trace.progress()
+        if progress is None:
+            line = "{} branches".format(self.index)
+        else:
+            line = "{0:.0f}% complete".format(progress * 100)
+        line += ", " + rate_summary(self.index - self.start, elapsed)
+        if progress is not None and progress > self.first_progress:
+            remaining = elapsed * (1 - progress) / (progress - self.first_progress)
+            line += ", ETA " + format_duration(remaining)
+        return line
+
+    def finish(self, end):
+        elapsed = time.perf_counter() - self.started
+        sys.stdout.write('\r')
+        print("Simulated {} branches in {}: {}".format(end - self.start, format_duration(elapsed),
+                                                        rate_summary(end - self.start, elapsed)))
+
+def rate_summary(branches, seconds):
+    if branches <= 0 or seconds <= 0:
+        return "- branches/s"
+    return "{0:.0f} branches/s, {1:.0f} ns/branch".format(branches / seconds, seconds / branches * 1e9)
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return "{}:{:02d}:{:02d}".format(hours, minutes, seconds)
+
+# Stage of every method the stage profiler times, by method name. Each
+# predictor's own predict is "other": the control logic and stats left
+# after its stages are taken out.
+METHOD_STAGES = {
+        'get_state':            'table lookup',
+        'get_tag_at':           'table lookup',
+        'output':               'table lookup',
+        'addressing_method':    'index/hash',
+        'index_tag_hash':       'index/hash',
+        'get_current_val':      'index/hash',
+        'update':               'update',
+        'was_taken':            'update',
+        'was_not_taken':        'update',
+        'shift_in':             'update',
+        'train':                'update',
+        'replace':              'TAGE replacement',
+        'age_useful_bits':      'aging',
+        'predict':              'other'
+        }
+# Methods whose stage depends on the class: tagged table predicts are
+# lookups, and a folded history update maintains TAGE's index/tag hash
+# inputs rather than predictor state
+CLASS_METHOD_STAGES = {
+        (TaggedTable, 'predict'):   'table lookup',
+        (FoldedHistory, 'update'):  'index/hash'
+        }
+DECODE_FUNCTIONS = ['decode_pc', 'decode_pc_fields']
+STAGE_ORDER = ['trace parse', 'PC decode', 'index/hash', 'table lookup', 'update',
+               'TAGE replacement', 'aging', 'other']
+
+class StageProfiler:
+    # Opt-in attribution of simulation time to stages. attach() shadows the
+    # staged methods of every predictor, table and history register with
+    # timing wrappers on the instances, and the PC decode functions in the
+    # predictor modules; detach() puts everything back. Each call is
+    # charged its own time minus that of the timed calls it makes. The
+    # measured cost of a wrapper is taken out of the caller's time too, but
+    # what is left of it still inflates the small stages most.
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.child_seconds = 0.0
+        self.overhead = 0.0
+        self.wrapped = []
+        self.patched = []
+        self.elapsed = 0.0
+        self.overhead = self.calibrate()
+
+    def timed(self, stage, function):
+        def timed_call(*args):
+            outer_child_seconds = self.child_seconds
+            self.child_seconds = 0.0
+            start = time.perf_counter()
+            try:
+                return function(*args)
+            finally:
+                elapsed = time.perf_counter() - start
+                self.seconds[stage] += elapsed - self.child_seconds
+                self.calls[stage] += 1
+                self.child_seconds = outer_child_seconds + elapsed + self.overhead
+        return timed_call
+
+    def calibrate(self, count=20000):
+        # Time per call a wrapper adds outside of its own measurement
+        timed_noop = self.timed('calibration', lambda: None)
+        start = time.perf_counter()
+        for _ in range(count):
+            timed_noop()
+        overhead = (time.perf_counter() - start - self.seconds.pop('calibration')) / count
+        del self.calls['calibration']
+        self.child_seconds = 0.0
+        return max(overhead, 0.0)
+
+    def attach(self, predictor_list):
+        seen = set()
+        for bp in predictor_list:
+            self.attach_object(bp, seen)
+        for module in (prediction_elements, predictors):
+            for name in DECODE_FUNCTIONS:
+                function = getattr(module, name)
+                self.patched.append((module, name, function))
+                setattr(module, name, self.timed('PC decode', function))
+        self.started = time.perf_counter()
+
+    def attach_object(self, obj, seen):
+        if id(obj) in seen:
+            return
+        seen.add(id(obj))
+        if isinstance(obj, dict):
+            self.attach_object(list(obj.values()), seen)
+        if isinstance(obj, (list, tuple)):
+            for item in obj:
+                self.attach_object(item, seen)
+            return
+        if type(obj).__module__ not in (predictors.__name__, prediction_elements.__name__):
+            return
+
+        for name, stage in METHOD_STAGES.items():
+            method = getattr(obj, name, None)
+            if method is None or not callable(method):
+                continue
+            for (cls, class_method), class_stage in CLASS_METHOD_STAGES.items():
+                if class_method == name and isinstance(obj, cls):
+                    stage = class_stage
+            setattr(obj, name, self.timed(stage, method))
+            self.wrapped.append((obj, name))
+        for value in list(vars(obj).values()):
+            self.attach_object(value, seen)
+
+    def detach(self):
+        self.elapsed = time.perf_counter() - self.started
+        for obj, name in self.wrapped:
+            delattr(obj, name)
+        for module, name, function in self.patched:
+            setattr(module, name, function)
+        self.wrapped = []
+        self.patched = []
+
+    def trace(self, trace):
+        return TimedTrace(trace, self)
+
+    def report(self, branches):
+        print("Stage profile of", branches, "branches in", '{0:.02f}'.format(self.elapsed), "s:")
+        print("Stage\t\t\t", "Calls\t\t", "ns/branch\t", "Share")
+        total = sum(self.seconds.values()) or 1.0
+        for stage in STAGE_ORDER:
+            if stage not in self.calls:
+                continue
+            seconds = self.seconds[stage]
+            print('{0:<16}'.format(stage), "\t", self.calls[stage], "\t\t",
+                  '{0:.0f}'.format(seconds / branches * 1e9 if branches else 0.0), "\t\t",
+                  '{0:.01f}'.format(seconds / total * 100), "%")
+        print()
+
+class TimedTrace:
+    # Charges the time spent producing each trace record to 'trace parse'
+    def __init__(self, trace, profiler):
+        self.trace = trace
+        self.profiler = profiler
+
+    def progress(self):
+        return self.trace.progress()
+
+    def __iter__(self):
+        records = iter(self.trace)
+        seconds = self.profiler.seconds
+        while True:
+            start = time.perf_counter()
+            try:
+                record = next(records)
+            except StopIteration:
+                return
+            seconds['trace parse'] += time.perf_counter() - start
+            self.profiler.calls['trace parse'] += 1
+            yield record
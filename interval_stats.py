@@ -0,0 +1,69 @@
+import csv
+import json
+
+from prediction_elements import stats_from_counts
+
+# Per-interval stats: the running counters of every predictor are read at
+# interval boundaries only and the differences written out as CSV rows or,
+# for any other extension, JSON lines. Both are flushed per interval, so the
+# file can be followed while the simulation runs.
+
+INTERVAL_FIELDS = ['method', 'counter_bits', 'counter_init', 'pht_entries', 'interval', 'start', 'end',
+                   'mispredictions', 'no_predictions', 'hit_predictions', 'total',
+                   'mpki', 'hit_rate', 'no_prediction_rate']
+TAGE_PROVIDERS = 5
+TAGE_FIELDS = ['provider_t{}'.format(comp) for comp in range(TAGE_PROVIDERS)] + ['allocation_failures']
+
+def counters(predictor):
+    values = [predictor.mispredictions, predictor.no_predictions, predictor.good_predictions]
+    if hasattr(predictor, 'provider_counts'):
+        values += predictor.provider_counts + [predictor.allocation_failures]
+    return values
+
+class IntervalRecorder:
+    def __init__(self, path, predictors, start=0):
+        self.predictors = predictors
+        self.start = start
+        self.interval = 0
+        self.last = [counters(bp) for bp in predictors]
+
+        self.file = open(path, 'w', newline='')
+        self.writer = None
+        if path.endswith(".csv"):
+            fields = INTERVAL_FIELDS
+            if any(hasattr(bp, 'provider_counts') for bp in predictors):
+                fields = fields + TAGE_FIELDS
+            self.writer = csv.DictWriter(self.file, fields, restval='')
+            self.writer.writeheader()
+
+    def record(self, end):
+        # Writes the interval from the previous boundary up to trace offset end
+        if end <= self.start:
+            return
+        for index, bp in enumerate(self.predictors):
+            now = counters(bp)
+            delta = [new - old for new, old in zip(now, self.last[index])]
+            self.last[index] = now
+
+            row = stats_from_counts(bp.get_method_type(), bp.num_state_bits, bp.init_state_val, bp.pht_size,
+                                    *delta[:3])
+            row['interval'] = self.interval
+            row['start'] = self.start
+            row['end'] = end
+            row['no_prediction_rate'] = row['no_predictions'] / row['total'] * 100 if row['total'] else 0.0
+            if len(delta) > 3:
+                row.update(zip(TAGE_FIELDS, delta[3:]))
+            self.write(row)
+
+        self.file.flush()
+        self.interval += 1
+        self.start = end
+
+    def write(self, row):
+        if self.writer is not None:
+            self.writer.writerow(row)
+        else:
+            self.file.write(json.dumps(row) + "\n")
+
+    def close(self):
+        self.file.close()
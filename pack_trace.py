@@ -0,0 +1,19 @@
+#!/usr/bin/python3
+
+import argparse
+
+from trace_io import convert_text_to_binary, BINARY_BLOCK_SIZE
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a text trace to the packed binary trace format")
+    parser.add_argument("input", help="Text trace file (\"<pc> <T|N>\" per line)")
+    parser.add_argument("output", help="Binary trace file to write")
+    parser.add_argument("-blocksize", help="Records per block (multiple of 8)",default=BINARY_BLOCK_SIZE,type=int,required=False)
+    args = parser.parse_args()
+
+    print("Packing...\n")
+    count = convert_text_to_binary(args.input, args.output, args.blocksize)
+    print(count, "branches written to", args.output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import os
+import sys
+import time
+import random
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from predictors import build_predictor
+from prediction_elements import *
+from trace_io import SharedTrace
+
+# Simulation of trace ranges in a process pool. The parent decodes the trace
+# into a SharedTrace once and every worker attaches to it on start-up.
+
+BLOCK_SIZE = 64 * 1024
+
+_shared_trace = None
+
+def attach_shared_trace(name, count):
+    global _shared_trace
+    _shared_trace = SharedTrace.attach(name, count)
+
+def simulate_range(bp, trace, start, end, engine='python'):
+    for block in range(start, end, BLOCK_SIZE):
+        pcs = trace.pcs[block:min(block + BLOCK_SIZE, end)]
+        outcomes = trace.outcomes[block:min(block + BLOCK_SIZE, end)]
+        if engine == 'numpy':
+            bp.predict_batch(pcs, outcomes)
+        else:
+            for pc, branch in zip(pcs.tolist(), outcomes.tolist()):
+                bp.predict(pc, branch)
+
+def run_range(config, start, end, warmup=0, engine='python', seed=None, sparse=False, history_length=None):
+    # Simulates branches [start, end) of the shared trace on a cold
+    # predictor, after replaying up to `warmup` preceding branches with
+    # their stats discarded
+    if seed is not None:
+        random.seed(seed)
+    bp = build_predictor(*config, sparse=sparse, history_length=history_length)
+
+    begin = time.perf_counter()
+    simulate_range(bp, _shared_trace, max(0, start - warmup), start, engine)
+    reset_stats(bp)
+    simulate_range(bp, _shared_trace, start, end, engine)
+
+    stats = get_stats(bp)
+    stats['seconds'] = time.perf_counter() - begin
+    return stats
+
+def chunk_bounds(count, chunks):
+    return [(count * i // chunks, count * (i + 1) // chunks) for i in range(chunks)]
+
+def run_pool(trace, tasks, jobs=None):
+    # tasks are argument tuples for run_range; results come back in order
+    results = [None] * len(tasks)
+    with ProcessPoolExecutor(max_workers=jobs or os.cpu_count(), initializer=attach_shared_trace,
+                             initargs=(trace.name, len(trace))) as pool:
+        futures = {pool.submit(run_range, *task): index for index, task in enumerate(tasks)}
+        for done, future in enumerate(as_completed(futures), 1):
+            results[futures[future]] = future.result()
+            sys.stdout.write('\r' + str(done) + "/" + str(len(tasks)) + " complete")
+            sys.stdout.flush()
+    return results
@@ -1,5 +1,15 @@
 import sys
 import math
+import functools
+from array import array
+from bisect import bisect_right
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from branch_profile import PROFILE_BUFFER
 
 class StateCounter:
     def __init__(self, bits, init_value):
@@ -37,34 +47,350 @@ class PredictorCounter(StateCounter):
         else:
             return None # No Prediction (Weak)
 
+class CounterTable:
+    # A table of StateCounters sharing one bit width and initial value,
+    # stored as a flat array of states instead of one object per entry
+    def __init__(self, bits, init_value, size):
+        self.bits = bits
+        self.max_val = 2**self.bits - 1
+        self.init_value = init_value
+        self.threshold = (self.max_val + 1) / 2
+
+        if 0 <= init_value <= self.max_val <= 255:
+            typecode = 'B'
+        else:
+            typecode = 'q'
+        self.states = array(typecode, [init_value]) * size
+
+    def __len__(self):
+        return len(self.states)
+
+    def __getitem__(self, index):
+        return self.states[index]
+
+    def __setitem__(self, index, state):
+        try:
+            self.states[index] = state
+        except OverflowError:
+            self.widen()
+            self.states[index] = state
+
+    def widen(self):
+        # Like StateCounter, a state set outside [0, max_val] keeps counting
+        # away from the range, so it may outgrow the compact typecode
+        self.states = array('q', self.states)
+
+    def get_state(self, index):
+        if self.states[index] >= self.threshold:
+            return 1
+        else:
+            return 0
+
+    def state_prediction(self, state):
+        return 1 if state >= self.threshold else 0
+
+    def was_taken(self, index):
+        state = self.states[index]
+        if state != self.max_val:
+            self[index] = state + 1
+
+    def was_not_taken(self, index):
+        state = self.states[index]
+        if state != 0:
+            self[index] = state - 1
+
+    def update(self, index, actual_branch):
+        if actual_branch == 1:
+            self.was_taken(index)
+        elif actual_branch == 0:
+            self.was_not_taken(index)
+
+    def batch_view(self):
+        # NumPy view of the states for bulk replay, or None when the table
+        # cannot be replayed in bulk
+        if np is None or self.states.typecode != 'B':
+            return None
+        return np.frombuffer(self.states, dtype=np.uint8)
+
+    def replay_batch(self, indices, outcomes):
+        # Applies the updates for outcomes at indices in order, and returns
+        # the state each update found. Every update is x -> clamp(x + a, lo, hi)
+        # and these maps compose into the same form. The updates are sorted
+        # by entry and each entry's chain is cut into segments of
+        # REPLAY_SEGMENT updates, one row each: the map of every segment is
+        # composed column by column, the segment maps of each chain are
+        # chained with a segmented parallel prefix, and each segment is then
+        # walked from its start state, again column by column.
+        states = self.batch_view()
+        count = len(indices)
+        if count == 0:
+            return np.zeros(0, np.int64)
+
+        order = np.argsort(indices, kind='stable')
+        sorted_indices = indices[order]
+        sorted_outcomes = outcomes[order]
+        steps = np.where(sorted_outcomes == 1, 1, np.where(sorted_outcomes == 0, -1, 0)).astype(np.int8)
+
+        group_start = np.ones(count, bool)
+        group_start[1:] = sorted_indices[1:] != sorted_indices[:-1]
+        starts = np.flatnonzero(group_start)
+        lengths = np.diff(np.append(starts, count))
+        rank = np.arange(count) - np.repeat(starts, lengths)
+
+        segment_counts = -(-lengths // REPLAY_SEGMENT)
+        first_segments = np.cumsum(segment_counts) - segment_counts
+        segment = np.repeat(first_segments, lengths) + rank // REPLAY_SEGMENT
+        column = rank % REPLAY_SEGMENT
+        num_segments = int(segment_counts.sum())
+        # Padding is a zero step, which leaves every state in range as it is
+        grid = np.zeros((num_segments, REPLAY_SEGMENT), np.int8)
+        grid[segment, column] = steps
+
+        shift = np.zeros(num_segments, np.int32)
+        low = np.zeros(num_segments, np.int32)
+        high = np.full(num_segments, self.max_val, np.int32)
+        for step in grid.T:
+            shift += step
+            np.clip(low + step, 0, self.max_val, out=low)
+            np.clip(high + step, 0, self.max_val, out=high)
+        segmented_prefix_maps(shift, low, high, np.repeat(first_segments, segment_counts))
+
+        # A chain's first segment starts from the table; the others from the
+        # prefix map of the segment before applied to it
+        chain_start = np.repeat(states[sorted_indices[starts]].astype(np.int32), segment_counts)
+        state = chain_start.copy()
+        state[1:] = np.minimum(high[:-1], np.maximum(low[:-1], chain_start[1:] + shift[:-1]))
+        state[first_segments] = chain_start[first_segments]
+
+        before = np.empty((num_segments, REPLAY_SEGMENT), np.int32)
+        for column_index, step in enumerate(grid.T):
+            before[:, column_index] = state
+            np.clip(state + step, 0, self.max_val, out=state)
+        states[sorted_indices[starts]] = state[first_segments + segment_counts - 1]
+
+        found = np.empty(count, np.int64)
+        found[order] = before[segment, column]
+        return found
+
+    def batch_predictions(self, states):
+        return (states >= self.threshold).astype(np.int8)
+
+class LazyCounterTable(CounterTable):
+    # CounterTable whose whole-table operations are not swept over the table.
+    # Each one starts a new generation and is folded into a state map; an
+    # entry is brought up to date with a single lookup the next time it is
+    # accessed. States must stay within [0, max_val].
+    def __init__(self, bits, init_value, size):
+        super().__init__(bits, init_value, size)
+        self.generation = 0
+        self.stamps = array('Q', [0]) * size
+        # pending_maps[k] maps a state stamped in generation
+        # [pending_starts[k], pending_starts[k + 1]) to its current value
+        self.pending_starts = [0]
+        self.pending_maps = [tuple(range(self.max_val + 1))]
+
+    def sync(self, index):
+        stamp = self.stamps[index]
+        if stamp != self.generation:
+            pending_map = self.pending_maps[bisect_right(self.pending_starts, stamp) - 1]
+            self.states[index] = pending_map[self.states[index]]
+            self.stamps[index] = self.generation
+
+    def apply_all(self, state_map):
+        starts = []
+        maps = []
+        for start, pending_map in zip(self.pending_starts, self.pending_maps):
+            pending_map = tuple(state_map[state] for state in pending_map)
+            if maps and maps[-1] == pending_map:
+                continue
+            starts.append(start)
+            maps.append(pending_map)
+
+        self.generation += 1
+        starts.append(self.generation)
+        maps.append(tuple(range(self.max_val + 1)))
+        self.pending_starts = starts
+        self.pending_maps = maps
+
+    def __getitem__(self, index):
+        if self.stamps[index] != self.generation:
+            self.sync(index)
+        return self.states[index]
+
+    def __setitem__(self, index, state):
+        self.states[index] = state
+        self.stamps[index] = self.generation
+
+    def get_state(self, index):
+        if self.stamps[index] != self.generation:
+            self.sync(index)
+        return super().get_state(index)
+
+    def was_taken(self, index):
+        if self.stamps[index] != self.generation:
+            self.sync(index)
+        super().was_taken(index)
+
+    def was_not_taken(self, index):
+        if self.stamps[index] != self.generation:
+            self.sync(index)
+        super().was_not_taken(index)
+
+    def and_all(self, mask):
+        self.apply_all([state & mask for state in range(self.max_val + 1)])
+
+    def decrement_all(self):
+        self.apply_all([max(state - 1, 0) for state in range(self.max_val + 1)])
+
+class PredictorCounterTable(CounterTable):
+    # CounterTable with the PredictorCounter read-out, including its weak
+    # "no prediction" states
+    def get_state(self, index):
+        state = self.states[index]
+        if state > self.threshold:
+            return 1    # Taken
+        if state < self.threshold - 1:
+            return 0    # Not Taken
+        else:
+            return None # No Prediction (Weak)
+
+    def state_prediction(self, state):
+        if state > self.threshold:
+            return 1
+        if state < self.threshold - 1:
+            return 0
+        return None
+
+    def batch_predictions(self, states):
+        # -1 stands for no prediction
+        return np.where(states > self.threshold, 1,
+                        np.where(states < self.threshold - 1, 0, -1)).astype(np.int8)
+
+class SparseCounterTable(CounterTable):
+    # CounterTable that only stores the entries written so far, so a huge
+    # table costs nothing up front and memory follows the working set.
+    # Untouched entries read as `default`, the initial value.
+    def __init__(self, bits, init_value, size):
+        self.bits = bits
+        self.max_val = 2**self.bits - 1
+        self.init_value = init_value
+        self.threshold = (self.max_val + 1) / 2
+        self.size = size
+        self.default = init_value
+        self.states = {}
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        return self.states.get(index, self.default)
+
+    def __setitem__(self, index, state):
+        self.states[index] = state
+
+    def touched(self):
+        return len(self.states)
+
+    def get_state(self, index):
+        return self.state_prediction(self.states.get(index, self.default))
+
+    def was_taken(self, index):
+        state = self.states.get(index, self.default)
+        if state != self.max_val:
+            state += 1
+        self.states[index] = state
+
+    def was_not_taken(self, index):
+        state = self.states.get(index, self.default)
+        if state != 0:
+            state -= 1
+        self.states[index] = state
+
+    def batch_view(self):
+        return None
+
+class SparsePredictorCounterTable(SparseCounterTable, PredictorCounterTable):
+    pass
+
+class SparseShiftRegisterTable(dict):
+    # Table of ShiftRegisters created on first access; missing ones hold 0
+    def __init__(self, bits, size):
+        super().__init__()
+        self.bits = bits
+        self.size = size
+
+    def __missing__(self, index):
+        register = self[index] = ShiftRegister(self.bits)
+        return register
+
+    def touched(self):
+        return len(self)
+
 class ShiftRegister:
+    # The newest bit is the LSB of value; bits older than max_bits are masked off
     def __init__(self, bits):
         self.max_bits = bits
-        self.register = [0 for i in range(bits)]
+        self.mask = (1 << bits) - 1
+        self.value = 0
     
     def shift_in(self, bit):
-        self.register.pop(0)
-        self.register.append(bit)
+        self.value = ((self.value << 1) | bit) & self.mask
 
     def get_current_val(self):
-        return int("".join(map(str, self.register)), 2)
+        return self.value
     
     def get_current_val_as_binstr(self):
-        return str("".join(map(str, self.register)))
+        return "{0:0{1}b}".format(self.value, self.max_bits) if self.max_bits else ""
+
+    @property
+    def register(self):
+        # Oldest bit first
+        return [(self.value >> i) & 1 for i in range(self.max_bits - 1, -1, -1)]
+
+    def batch_values(self, bits):
+        # Register value before each of bits is shifted in, plus the value
+        # after the last one, without changing the register
+        count = len(bits)
+        values = np.zeros(count + 1, np.int64)
+        extended = np.concatenate((np.array(self.register, dtype=np.int64), bits.astype(np.int64)))
+        for age in range(self.max_bits):
+            start = self.max_bits - 1 - age
+            values |= extended[start:start + count + 1] << age
+        return values
+
+class FoldedHistory:
+    # The newest `length` bits of a history register XOR-folded into `width`
+    # bits, kept up to date in O(1) per shifted-in bit (a circular shift
+    # register, as in Seznec's TAGE)
+    def __init__(self, length, width):
+        self.length = length
+        self.width = width
+        self.mask = (1 << width) - 1
+        self.out_point = length % width
+        self.value = 0
+
+    def update(self, new_bit, history):
+        # history is the register value before new_bit is shifted in
+        dropped_bit = (history >> (self.length - 1)) & 1
+        value = (self.value << 1) | new_bit
+        value ^= dropped_bit << self.out_point
+        value ^= value >> self.width
+        self.value = value & self.mask
 
 class BranchPredictor:
-    def __init__(self, num_state_bits, init_state_val, pht_size):
+    def __init__(self, num_state_bits, init_state_val, pht_size, sparse=False):
         offset = 0
         self.pht_numbits = math.frexp(pht_size)[1] - 1
-        self.cut_pc = [self.pht_numbits + offset, offset]
-        self.pattern_history_table = [PredictorCounter(num_state_bits, init_state_val) 
-                    for i in range(pht_size)]
+        self.cut_pc = (self.pht_numbits + offset, offset)
+        self.sparse = sparse
+        table = SparsePredictorCounterTable if sparse else PredictorCounterTable
+        self.pattern_history_table = table(num_state_bits, init_state_val, pht_size)
 
         init_basic_vars(self, num_state_bits, init_state_val, pht_size)
         self.count = 0
 
     def predict(self, pc, actual_branch):
-        cutpc = get_from_bitrange(self.cut_pc, pc)
+        cutpc = decode_pc(pc, self.cut_pc)
 
         prediction = self.prediction_method(cutpc, actual_branch)
 
@@ -74,12 +400,59 @@ class BranchPredictor:
             self.mispredictions += 1
         if prediction is None:
             self.no_predictions += 1
+        profile = self.profile
+        if profile is not None:
+            profile.executed.append(pc)
+            if prediction != actual_branch:
+                (profile.unpredicted if prediction is None else profile.missed).append(pc)
+            if len(profile.executed) >= PROFILE_BUFFER:
+                profile.flush()
 
         return prediction
 
     def prediction_method(self, cutpc, actual_branch):
         pass
+
+    def warm(self, pc, actual_branch):
+        # Trains the predictor on a branch like predict, without counting it
+        # in the stats or the profile
+        self.update_method(decode_pc(pc, self.cut_pc), actual_branch)
+
+    def update_method(self, cutpc, actual_branch):
+        # The state updates of prediction_method. Subclasses whose updates
+        # do not need the prediction skip the lookup.
+        self.prediction_method(cutpc, actual_branch)
+
+    def predict_batch(self, pcs, outcomes):
+        # Same as calling predict for each branch in order. Subclasses whose
+        # PHT addresses do not depend on their own predictions replay whole
+        # batches with NumPy instead.
+        for pc, actual_branch in zip(batch_list(pcs), batch_list(outcomes)):
+            self.predict(pc, actual_branch)
+
+    def warm_batch(self, pcs, outcomes):
+        # Same as calling warm for each branch in order
+        for pc, actual_branch in zip(batch_list(pcs), batch_list(outcomes)):
+            self.warm(pc, actual_branch)
+
+    def can_replay_batch(self):
+        return self.pattern_history_table.batch_view() is not None
+
+    def replay_batch(self, pht_addresses, outcomes, pcs):
+        states = self.pattern_history_table.replay_batch(pht_addresses, outcomes)
+        predictions = self.pattern_history_table.batch_predictions(states)
+        if self.profile is not None:
+            self.profile.record_batch(pcs, predictions, outcomes)
+
+        good = int(np.count_nonzero(predictions == outcomes))
+        no_prediction = int(np.count_nonzero(predictions == -1))
+        self.good_predictions += good
+        self.no_predictions += no_prediction
+        self.mispredictions += len(outcomes) - good - no_prediction
     
+    def touched_entries(self):
+        return self.pattern_history_table.touched()
+
     def get_method_type(self):
         return type(self).__name__.rstrip()
 
@@ -87,21 +460,17 @@ class BranchPredictor:
 class TAGEBimodalBase(BranchPredictor):
     def __init__(self, num_state_bits, init_state_val, pht_size):
         super().__init__(num_state_bits, init_state_val, pht_size)
-        self.pattern_history_table = [StateCounter(num_state_bits, init_state_val) 
-                    for i in range(pht_size)]
+        self.pattern_history_table = CounterTable(num_state_bits, init_state_val, pht_size)
 
     def prediction_method(self, cutpc, actual_branch):
         pht_address = cutpc
-        prediction = self.pattern_history_table[pht_address].get_state()
+        prediction = self.pattern_history_table.get_state(pht_address)
         return prediction
 
     def update(self, pc, actual_branch):
-        cutpc = get_from_bitrange(self.cut_pc, pc)
+        cutpc = decode_pc(pc, self.cut_pc)
         pht_address = cutpc
-        if actual_branch == 1:
-            self.pattern_history_table[pht_address].was_taken()
-        elif actual_branch == 0:
-            self.pattern_history_table[pht_address].was_not_taken()
+        self.pattern_history_table.update(pht_address, actual_branch)
 
 class TaggedTable:
     def __init__(self, num_state_bits, init_state_val):
@@ -109,42 +478,83 @@ class TaggedTable:
         num_entries = 2**self.index_bits
         self.tag_width = 8
 
-        self.counters = [StateCounter(num_state_bits, init_state_val)
-                for i in range(num_entries)]
-        self.tags = [0 for i in range(num_entries)]
-        self.useful_bits = [StateCounter(2, 0) for i in  range(num_entries)]
+        self.counters = CounterTable(num_state_bits, init_state_val, num_entries)
+        self.tags = array('L', [0]) * num_entries
+        self.useful_bits = LazyCounterTable(2, 0, num_entries)
 
     def predict(self, index, actual_branch):
-        prediction = self.counters[index].get_state()
+        prediction = self.counters.get_state(index)
         return prediction
 
     def update(self, index, actual_branch):
-        if actual_branch == 1:
-            self.counters[index].was_taken()
-        elif actual_branch == 0:
-            self.counters[index].was_not_taken()
+        self.counters.update(index, actual_branch)
 
     def get_tag_at(self, index):
         return self.tags[index]
 
 def print_stats(predictor):
-        total = predictor.no_predictions + predictor.good_predictions + predictor.mispredictions
-        print("\n\n\n\t\t---Sim Result---")
-        print("Type\t\t", "Counter Bits\t", "Counter init\t","PHT entries")
-        print(predictor.get_method_type(), "\t", predictor.num_state_bits, "\t\t", predictor.init_state_val,"\t\t", predictor.pht_size, "\n")
-        print("Mispredictions:\t\t", predictor.mispredictions)
-        print("No Predictions:\t\t", predictor.no_predictions)
-        print("Hit Predictions:\t", predictor.good_predictions)
-        print("Total:\t\t\t", total)
-        #print("Hit rate:\t\t", '{0:.04f}'.format(self.good_predictions / (total - self.no_predictions) * 100), "%")
-        print("Hit rate:\t\t", '{0:.04f}'.format(predictor.good_predictions / (total) * 100), "%")
-        print("MP/KI:\t\t\t", '{0:.04f}'.format((predictor.mispredictions + predictor.no_predictions) / total * 1000), '\n')
+        print_stats_summary(get_stats(predictor))
 
         #disp_big_list(predictor.T[1].tags)
         #disp_big_list(predictor.T[2].tags)
         #disp_big_list(predictor.T[3].tags)
         #disp_big_list(predictor.T[4].tags)
 
+def print_stats_summary(stats):
+        print("\n\n\n\t\t---Sim Result---")
+        print("Type\t\t", "Counter Bits\t", "Counter init\t","PHT entries")
+        print(stats['method'], "\t", stats['counter_bits'], "\t\t", stats['counter_init'],"\t\t", stats['pht_entries'], "\n")
+        print("Mispredictions:\t\t", stats['mispredictions'])
+        print("No Predictions:\t\t", stats['no_predictions'])
+        print("Hit Predictions:\t", stats['hit_predictions'])
+        print("Total:\t\t\t", stats['total'])
+        print("Hit rate:\t\t", '{0:.04f}'.format(stats['hit_rate']), "%")
+        print("MP/KI:\t\t\t", '{0:.04f}'.format(stats['mpki']), '\n')
+        if 'touched_entries' in stats:
+            print("Touched entries:\t", stats['touched_entries'], '\n')
+
+def get_stats(predictor):
+    stats = stats_from_counts(predictor.get_method_type(), predictor.num_state_bits, predictor.init_state_val,
+                              predictor.pht_size, predictor.mispredictions, predictor.no_predictions,
+                              predictor.good_predictions)
+    if getattr(predictor, 'sparse', False):
+        stats['touched_entries'] = predictor.touched_entries()
+    return stats
+
+def stats_from_counts(method, num_state_bits, init_state_val, pht_size, mispredictions, no_predictions, good_predictions):
+    total = no_predictions + good_predictions + mispredictions
+    return {
+            'method':           method,
+            'counter_bits':     num_state_bits,
+            'counter_init':     init_state_val,
+            'pht_entries':      pht_size,
+            'mispredictions':   mispredictions,
+            'no_predictions':   no_predictions,
+            'hit_predictions':  good_predictions,
+            'total':            total,
+            'hit_rate':         good_predictions / total * 100 if total else 0.0,
+            'mpki':             (mispredictions + no_predictions) / total * 1000 if total else 0.0
+            }
+
+def merge_stats(stats_list):
+    # Sums the counts of get_stats() results for the same configuration
+    first = stats_list[0]
+    return stats_from_counts(first['method'], first['counter_bits'], first['counter_init'], first['pht_entries'],
+                             sum(stats['mispredictions'] for stats in stats_list),
+                             sum(stats['no_predictions'] for stats in stats_list),
+                             sum(stats['hit_predictions'] for stats in stats_list))
+
+def print_stats_table(stats_list):
+    # stats_list holds get_stats() results
+    print("\n\n\n\t\t---Sim Results---")
+    row = "{:<22}{:>6}{:>6}{:>10}{:>16}{:>16}{:>12}{:>12}"
+    print(row.format("Type", "Bits", "Init", "PHT", "Mispredictions", "No Predictions", "Hit rate", "MP/KI"))
+    for stats in stats_list:
+        print(row.format(stats['method'], stats['counter_bits'], stats['counter_init'], stats['pht_entries'],
+                         stats['mispredictions'], stats['no_predictions'],
+                         '{0:.04f} %'.format(stats['hit_rate']), '{0:.04f}'.format(stats['mpki'])))
+    print()
+
 def init_basic_vars(predictor, num_state_bits, init_state_val, pht_size):
     predictor.num_state_bits = num_state_bits
     predictor.init_state_val = init_state_val
@@ -152,24 +562,71 @@ def init_basic_vars(predictor, num_state_bits, init_state_val, pht_size):
     predictor.mispredictions = 0
     predictor.good_predictions = 0
     predictor.no_predictions = 0
+    # Optional branch_profile.BranchProfile fed by predict
+    predictor.profile = None
+
+def reset_stats(predictor):
+    predictor.mispredictions = 0
+    predictor.good_predictions = 0
+    predictor.no_predictions = 0
 
 def norm_branch(branch):
-    return 1 if branch.rstrip() is 'T' else 0
+    return 1 if branch.rstrip() == 'T' else 0
 
 def get_from_bitrange(bit_range, dec_val):
+    # Bits [left_bit, right_bit) of dec_val, counted from the LSB
     left_bit, right_bit = bit_range
-    binary_string = "{0:064b}".format(int(dec_val))
-    left_bit = len(binary_string) - left_bit
-    right_bit = len(binary_string) - right_bit
-    cut_string = binary_string[left_bit:right_bit]
-    return 0 if left_bit == right_bit else int(cut_string, 2)
+    return (int(dec_val) >> right_bit) & ((1 << (left_bit - right_bit)) - 1)
+
+# Real traces execute a small set of static branches many times, so the PC
+# fields every predictor slices out are memoized per (pc, bit range). The
+# cache is shared: composite predictors and their components hit the same
+# entries, and text-trace PCs are parsed once per static branch.
+PC_DECODE_CACHE_SIZE = 64 * 1024
+
+@functools.lru_cache(maxsize=PC_DECODE_CACHE_SIZE)
+def decode_pc(pc, bit_range):
+    return get_from_bitrange(bit_range, pc)
+
+@functools.lru_cache(maxsize=PC_DECODE_CACHE_SIZE)
+def decode_pc_fields(pc, bit_ranges):
+    return tuple(get_from_bitrange(bit_range, pc) for bit_range in bit_ranges)
 
 def binstr_get_from_bitrange(bit_range, binary_string):
+    return get_from_bitrange(bit_range, int(binary_string, 2)) if binary_string else 0
+
+# Updates per row of CounterTable.replay_batch
+REPLAY_SEGMENT = 16
+
+def segmented_prefix_maps(shift, low, high, first):
+    # In place, turns each map x -> clamp(x + shift, low, high) into the
+    # composition of all maps from first (its segment's start) up to itself.
+    # Positions whose segment is already fully covered drop out of later
+    # passes.
+    position = np.arange(len(shift))
+    active = position[position - first >= 1]
+    span = 1
+    while len(active):
+        earlier = active - span
+        # The earlier map is applied first, then the later one
+        new_low = np.clip(low[earlier] + shift[active], low[active], high[active])
+        new_high = np.clip(high[earlier] + shift[active], low[active], high[active])
+        shift[active] += shift[earlier]
+        low[active] = new_low
+        high[active] = new_high
+        span *= 2
+        active = active[active - first[active] >= span]
+
+def batch_list(values):
+    return values.tolist() if hasattr(values, 'tolist') else values
+
+def batch_arrays(pcs, outcomes):
+    return np.asarray(pcs, dtype=np.uint64), np.asarray(outcomes, dtype=np.uint8)
+
+def batch_get_from_bitrange(bit_range, values):
     left_bit, right_bit = bit_range
-    left_bit = len(binary_string) - left_bit
-    right_bit = len(binary_string) - right_bit
-    cut_string = binary_string[left_bit:right_bit]
-    return 0 if left_bit == right_bit else int(cut_string, 2)
+    mask = (1 << (left_bit - right_bit)) - 1
+    return ((values >> np.uint64(right_bit)) & np.uint64(mask)).astype(np.int64)
 
 def disp_big_list(lst, rows = 50):
     table_list = [[] for _ in range(rows)]
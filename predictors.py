@@ -5,49 +5,91 @@ import random
 from prediction_elements import *
 
 class OneLevel(BranchPredictor):
-    def __init__(self, num_state_bits, init_state_val, pht_size):
-        super().__init__(num_state_bits, init_state_val, pht_size)
+    def __init__(self, num_state_bits, init_state_val, pht_size, sparse=False):
+        super().__init__(num_state_bits, init_state_val, pht_size, sparse)
 
     def prediction_method(self, cutpc, actual_branch):
         pht_address = cutpc
-        prediction = self.pattern_history_table[pht_address].get_state()
+        prediction = self.pattern_history_table.get_state(pht_address)
 
-        if actual_branch is 1:
-            self.pattern_history_table[pht_address].was_taken()
-        elif actual_branch is 0:
-            self.pattern_history_table[pht_address].was_not_taken()
+        self.pattern_history_table.update(pht_address, actual_branch)
 
         return prediction
 
+    def update_method(self, cutpc, actual_branch):
+        self.pattern_history_table.update(cutpc, actual_branch)
+
+    def predict_batch(self, pcs, outcomes):
+        if not self.can_replay_batch():
+            return super().predict_batch(pcs, outcomes)
+        pcs, outcomes = batch_arrays(pcs, outcomes)
+        cutpcs = batch_get_from_bitrange(self.cut_pc, pcs)
+        self.replay_batch(cutpcs, outcomes, pcs)
+
+    def warm_batch(self, pcs, outcomes):
+        if not self.can_replay_batch():
+            return super().warm_batch(pcs, outcomes)
+        pcs, outcomes = batch_arrays(pcs, outcomes)
+        self.pattern_history_table.replay_batch(batch_get_from_bitrange(self.cut_pc, pcs), outcomes)
+
 class TwoLevelGlobal(BranchPredictor):
-    def __init__(self, num_state_bits, init_state_val, pht_size):
-        super().__init__(num_state_bits, init_state_val, pht_size)
+    def __init__(self, num_state_bits, init_state_val, pht_size, sparse=False):
+        super().__init__(num_state_bits, init_state_val, pht_size, sparse)
 
         self.g_hist_reg_width = self.pht_numbits
         self.global_branch_history = ShiftRegister(self.g_hist_reg_width)
 
     def prediction_method(self, cutpc, actual_branch):
         pht_address = self.addressing_method(cutpc, actual_branch)
-        prediction = self.pattern_history_table[pht_address].get_state()
+        prediction = self.pattern_history_table.get_state(pht_address)
 
         self.global_branch_history.shift_in(actual_branch)
-        if actual_branch is 1:
-            self.pattern_history_table[pht_address].was_taken()
-        elif actual_branch is 0:
-            self.pattern_history_table[pht_address].was_not_taken()
+        self.pattern_history_table.update(pht_address, actual_branch)
 
         return prediction
+
+    def update_method(self, cutpc, actual_branch):
+        pht_address = self.addressing_method(cutpc, actual_branch)
+        self.global_branch_history.shift_in(actual_branch)
+        self.pattern_history_table.update(pht_address, actual_branch)
     
     def addressing_method(self, cutpc, actual_branch):
         return self.global_branch_history.get_current_val()
 
+    def predict_batch(self, pcs, outcomes):
+        if not self.can_replay_batch():
+            return super().predict_batch(pcs, outcomes)
+        pcs, outcomes = batch_arrays(pcs, outcomes)
+        self.replay_batch(self.batch_pht_addresses(pcs, outcomes), outcomes, pcs)
+
+    def warm_batch(self, pcs, outcomes):
+        if not self.can_replay_batch():
+            return super().warm_batch(pcs, outcomes)
+        pcs, outcomes = batch_arrays(pcs, outcomes)
+        self.pattern_history_table.replay_batch(self.batch_pht_addresses(pcs, outcomes), outcomes)
+
+    def batch_pht_addresses(self, pcs, outcomes):
+        # The history register only ever holds actual outcomes, so every PHT
+        # address of the batch is known up front. Leaves the register as it
+        # is after the batch.
+        cutpcs = batch_get_from_bitrange(self.cut_pc, pcs)
+        histories = self.global_branch_history.batch_values(outcomes)
+        self.global_branch_history.value = int(histories[-1])
+        return self.batch_addressing(cutpcs, histories[:-1])
+
+    def batch_addressing(self, cutpcs, histories):
+        return histories
+
 class GShare(TwoLevelGlobal):
-    def __init__(self, num_state_bits, init_state_val, pht_size):
-        super().__init__(num_state_bits, init_state_val, pht_size)
+    def __init__(self, num_state_bits, init_state_val, pht_size, sparse=False):
+        super().__init__(num_state_bits, init_state_val, pht_size, sparse)
         
     def addressing_method(self, cutpc, actual_branch):
         return cutpc ^ self.global_branch_history.get_current_val()
 
+    def batch_addressing(self, cutpcs, histories):
+        return cutpcs ^ histories
+
     def print_debug_stats(self):
         print("\n---Debug---")
         print("Bits in history register:\t\t", self.g_hist_reg_width)
@@ -55,47 +97,57 @@ class GShare(TwoLevelGlobal):
         print("Value of global history reg:\t\t", self.global_branch_history.get_current_val())
 
 class TwoLevelLocal(BranchPredictor):
-    def __init__(self, num_state_bits, init_state_val, pht_size):
-        super().__init__(num_state_bits, init_state_val, pht_size)
+    def __init__(self, num_state_bits, init_state_val, pht_size, sparse=False):
+        super().__init__(num_state_bits, init_state_val, pht_size, sparse)
         self.g_hist_reg_width = self.pht_numbits
 
         self.local_hist_reg_table_size =  128
 
         self.reg_table_numbits = math.frexp(self.local_hist_reg_table_size)[1] - 1
-        self.cut_pc = [32, 32 - self.reg_table_numbits]
+        self.cut_pc = (32, 32 - self.reg_table_numbits)
 
-        self.local_hist_reg_table = [ShiftRegister(self.g_hist_reg_width) 
-                for i in range(self.local_hist_reg_table_size)]
+        if sparse:
+            self.local_hist_reg_table = SparseShiftRegisterTable(self.g_hist_reg_width,
+                    self.local_hist_reg_table_size)
+        else:
+            self.local_hist_reg_table = [ShiftRegister(self.g_hist_reg_width) 
+                    for i in range(self.local_hist_reg_table_size)]
 
     def prediction_method(self, cutpc, actual_branch):
         pht_address = self.local_hist_reg_table[cutpc].get_current_val()
-        prediction = self.pattern_history_table[pht_address].get_state()
+        prediction = self.pattern_history_table.get_state(pht_address)
 
         self.local_hist_reg_table[cutpc].shift_in(actual_branch)
-        if actual_branch is 1:
-            self.pattern_history_table[pht_address].was_taken()
-        elif actual_branch is 0:
-            self.pattern_history_table[pht_address].was_not_taken()
+        self.pattern_history_table.update(pht_address, actual_branch)
         
         return prediction
 
+    def update_method(self, cutpc, actual_branch):
+        pht_address = self.local_hist_reg_table[cutpc].get_current_val()
+        self.local_hist_reg_table[cutpc].shift_in(actual_branch)
+        self.pattern_history_table.update(pht_address, actual_branch)
+
+    def touched_entries(self):
+        return self.pattern_history_table.touched() + self.local_hist_reg_table.touched()
+
 class TournamentPredictor:
-    def __init__(self, num_state_bits, init_state_val, pht_size):
+    def __init__(self, num_state_bits, init_state_val, pht_size, sparse=False):
         offset = 0
         self.pht_numbits = math.frexp(pht_size)[1] - 1
-        self.cut_pc = [self.pht_numbits + offset, offset]
+        self.cut_pc = (self.pht_numbits + offset, offset)
+        self.sparse = sparse
 
-        gshare_predictor = GShare(num_state_bits, init_state_val, pht_size)
-        one_level_predictor = OneLevel(num_state_bits, init_state_val, pht_size)
+        gshare_predictor = GShare(num_state_bits, init_state_val, pht_size, sparse)
+        one_level_predictor = OneLevel(num_state_bits, init_state_val, pht_size, sparse)
         self.predictors = [gshare_predictor, one_level_predictor]
-        self.meta_predictor = [StateCounter(num_state_bits, init_state_val)
-                for i in range(pht_size)]
+        table = SparseCounterTable if sparse else CounterTable
+        self.meta_predictor = table(num_state_bits, init_state_val, pht_size)
 
         init_basic_vars(self, num_state_bits, init_state_val, pht_size)
 
     def predict(self, pc, actual_branch):
-        cutpc = get_from_bitrange(self.cut_pc, pc)
-        choosen_predictor = self.meta_predictor[cutpc].get_state()
+        cutpc = decode_pc(pc, self.cut_pc)
+        choosen_predictor = self.meta_predictor.get_state(cutpc)
         predictions = [self.predictors[0].predict(pc, actual_branch), self.predictors[1].predict(pc, actual_branch)]
         chosen_prediction = predictions[choosen_predictor]
 
@@ -105,19 +157,52 @@ class TournamentPredictor:
             self.mispredictions += 1
         elif chosen_prediction is None:
             self.no_predictions += 1
-
+        profile = self.profile
+        if profile is not None:
+            profile.executed.append(pc)
+            if chosen_prediction != actual_branch:
+                (profile.unpredicted if chosen_prediction is None else profile.missed).append(pc)
+            if len(profile.executed) >= PROFILE_BUFFER:
+                profile.flush()
+
+        self.update_meta(cutpc, predictions, actual_branch)
+
+    def warm(self, pc, actual_branch):
+        # Trains the predictor on a branch like predict, without counting it
+        # in the stats or the profile of either component
+        predictions = [bp.prediction_method(decode_pc(pc, bp.cut_pc), actual_branch) for bp in self.predictors]
+        self.update_meta(decode_pc(pc, self.cut_pc), predictions, actual_branch)
+
+    def update_meta(self, cutpc, predictions, actual_branch):
         if (predictions[0] == predictions[1]):
             pass
         elif (predictions[0] == actual_branch):
-            self.meta_predictor[cutpc].was_not_taken()
+            self.meta_predictor.was_not_taken(cutpc)
         elif (predictions[1] == actual_branch):
-            self.meta_predictor[cutpc].was_taken()
+            self.meta_predictor.was_taken(cutpc)
+
+    def predict_batch(self, pcs, outcomes):
+        for pc, actual_branch in zip(batch_list(pcs), batch_list(outcomes)):
+            self.predict(pc, actual_branch)
+
+    def warm_batch(self, pcs, outcomes):
+        for pc, actual_branch in zip(batch_list(pcs), batch_list(outcomes)):
+            self.warm(pc, actual_branch)
+
+    def touched_entries(self):
+        return (self.predictors[0].touched_entries() + self.predictors[1].touched_entries()
+                + self.meta_predictor.touched())
 
     def get_method_type(self):
         return type(self).__name__.rstrip()
 
+# PC bits hashed into the tagged table indices and tags
+pc_off = 4
+TAGE_PC_FIELDS = ((10+pc_off,0+pc_off), (20+pc_off,10+pc_off), (8+pc_off,0+pc_off))
+
 class TAGEPredictor:
-    def __init__(self, num_state_bits, init_state_val, num_base_entries):
+    # Table sizes are fixed, so sparse tables are not used
+    def __init__(self, num_state_bits, init_state_val, num_base_entries, sparse=False):
         base_predictor = TAGEBimodalBase(2, init_state_val, 4096)
 
         # Init tagged predictors
@@ -131,20 +216,61 @@ class TAGEPredictor:
         self.global_history_register = ShiftRegister(80)
         init_basic_vars(self, num_state_bits, init_state_val, num_base_entries)
 
+        # Folded global histories per tagged component: index, tag R1, tag R2.
+        # Component i uses the newest 10 * 2**(i - 1) history bits.
+        self.folded_histories = [None]
+        for comp in range(1,5):
+            history_length = 2**(comp - 1) * 10
+            self.folded_histories.append([FoldedHistory(history_length, 10),
+                                          FoldedHistory((history_length // 8) * 8, 8),
+                                          FoldedHistory((history_length // 7) * 7, 7)])
+
         self.count = 0
         self.msb_flip = True
 
+        # Predictions provided per component, and mispredictions that found
+        # no entry with a clear useful counter to allocate
+        self.provider_counts = [0] * 5
+        self.allocation_failures = 0
+
     def predict(self, pc, actual_branch):
+        overall_prediction, provider_index, allocation_failed = self.step(pc, actual_branch)
+
+        self.provider_counts[provider_index] += 1
+        if overall_prediction == actual_branch:
+            self.good_predictions += 1
+        elif overall_prediction is not None:
+            self.mispredictions += 1
+            if allocation_failed:
+                self.allocation_failures += 1
+        else:
+            self.no_predictions += 1
+        profile = self.profile
+        if profile is not None:
+            profile.executed.append(pc)
+            if overall_prediction != actual_branch:
+                (profile.unpredicted if overall_prediction is None else profile.missed).append(pc)
+            if len(profile.executed) >= PROFILE_BUFFER:
+                profile.flush()
+
+    def warm(self, pc, actual_branch):
+        # Trains the predictor on a branch like predict, without counting it
+        # in the stats or the profile
+        self.step(pc, actual_branch)
+
+    def step(self, pc, actual_branch):
+        # Predicts the branch and trains every component on it. Returns the
+        # prediction, the providing component and whether a misprediction
+        # found no entry to allocate.
         predictions = []
         tagged_predictors_index_tag = []
-        present_ghr_binstr = self.global_history_register.get_current_val_as_binstr()
 
         # Base predictor 0
-        predictions.append(self.T[0].predict(pc, actual_branch))
+        predictions.append(self.T[0].prediction_method(decode_pc(pc, self.T[0].cut_pc), actual_branch))
 
         # Tagged predictors 1-4
         check_equal = []
-        tagged_predictors_index_tag = [self.index_tag_hash(pc, present_ghr_binstr, i) for i in range(1,5)]
+        tagged_predictors_index_tag = [self.index_tag_hash(pc, i) for i in range(1,5)]
 
         for i in range(1,5):
             predictions.append(self.T[i].predict(tagged_predictors_index_tag[i - 1][0], actual_branch))
@@ -178,97 +304,264 @@ class TAGEPredictor:
         # Update useful counter
         if (altpred != overall_prediction) & (provider_index != 0):
             if overall_prediction == actual_branch:
-                self.T[provider_index].useful_bits[tagged_predictors_index_tag[provider_index - 1][0]].was_taken()
+                self.T[provider_index].useful_bits.was_taken(tagged_predictors_index_tag[provider_index - 1][0])
             elif overall_prediction is not None:
-                self.T[provider_index].useful_bits[tagged_predictors_index_tag[provider_index - 1][0]].was_not_taken()
-
-        if overall_prediction == actual_branch:
-            self.good_predictions += 1
-        elif overall_prediction is not None:
-            self.mispredictions += 1
-
-            # Replacement Policy
-            T_k_index = 0
-            T_j_index = 0
-            if provider_index != 4:
-                #for i in range(4,provider_index,-1):
-                for i in range(provider_index+1,5):
-                    u_counter = self.T[i].useful_bits[tagged_predictors_index_tag[i-1][0]].state
-                    if u_counter == 0:
-                        T_k_index = i
-                        break
-                else:
-                    for tagged_component in self.T[1: (provider_index - 1)]:
-                        for u_counter in tagged_component.useful_bits:
-                            u_counter.was_not_taken()
-
-            if T_k_index >= 1:
-                for i in range(T_k_index - 1, 0,-1):
-                    u_counter = self.T[i].useful_bits[tagged_predictors_index_tag[i-1][0]].state
-                    if u_counter == 0:
-                        T_j_index = i
-                        break
-                else:
-                    self.T[T_k_index].tags[tagged_predictors_index_tag[T_k_index-1][0]] = tagged_predictors_index_tag[T_k_index-1][1]
-                    self.T[T_k_index].useful_bits[tagged_predictors_index_tag[T_k_index-1][0]].state = 0
-                    self.T[T_k_index].counters[tagged_predictors_index_tag[T_k_index-1][0]].state = 4
-                
-                if T_j_index != 0:
-                    rand_num = random.randint(1,3)
-                    if rand_num == 3:
-                        self.T[T_j_index].tags[tagged_predictors_index_tag[T_j_index-1][0]] = tagged_predictors_index_tag[T_j_index-1][1]
-                        self.T[T_j_index].useful_bits[tagged_predictors_index_tag[T_j_index-1][0]].state = 0
-                        self.T[T_j_index].counters[tagged_predictors_index_tag[T_j_index-1][0]].state = 4
-
-                    else:
-                        
-                        self.T[T_k_index].tags[tagged_predictors_index_tag[T_k_index-1][0]] = tagged_predictors_index_tag[T_k_index-1][1]
-                        self.T[T_k_index].useful_bits[tagged_predictors_index_tag[T_k_index-1][0]].state = 0
-                        self.T[T_k_index].counters[tagged_predictors_index_tag[T_k_index-1][0]].state = 4
+                self.T[provider_index].useful_bits.was_not_taken(tagged_predictors_index_tag[provider_index - 1][0])
 
-
-        else:
-            self.no_predictions += 1
+        allocation_failed = False
+        if overall_prediction != actual_branch and overall_prediction is not None:
+            allocation_failed = self.replace(provider_index, tagged_predictors_index_tag)
 
         self.count += 1
 
         if self.count == (256 * 1024):
-            if self.msb_flip:
-                for tagged_component in self.T[1:]:
-                    for u_counter in tagged_component.useful_bits:
-                        u_counter.state &= 1
-            else:
-                for tagged_component in self.T[1:]:
-                    for u_counter in tagged_component.useful_bits:
-                        u_counter.state &= 2
-
-            self.count = 0
-            self.msb_flip = not self.msb_flip
+            self.age_useful_bits()
         
+        present_ghr = self.global_history_register.get_current_val()
+        for folds in self.folded_histories[1:]:
+            for folded in folds:
+                folded.update(actual_branch, present_ghr)
         self.global_history_register.shift_in(actual_branch)
 
-    def index_tag_hash(self, pc, ghr_binstr, comp):
-        pc_off = 4
-        index_pc = get_from_bitrange([10+pc_off,0+pc_off], pc) ^ get_from_bitrange([20+pc_off,10+pc_off], pc)
-        index_ghr = binstr_get_from_bitrange([10,0],ghr_binstr)
+        return overall_prediction, provider_index, allocation_failed
+
+    def replace(self, provider_index, tagged_predictors_index_tag):
+        # Replacement policy on a misprediction: allocate an entry in a
+        # component above the provider. Returns whether none had a clear
+        # useful counter.
+        T_k_index = 0
+        T_j_index = 0
+        allocation_failed = False
+        if provider_index != 4:
+            #for i in range(4,provider_index,-1):
+            for i in range(provider_index+1,5):
+                u_counter = self.T[i].useful_bits[tagged_predictors_index_tag[i-1][0]]
+                if u_counter == 0:
+                    T_k_index = i
+                    break
+            else:
+                allocation_failed = True
+                for tagged_component in self.T[1: (provider_index - 1)]:
+                    tagged_component.useful_bits.decrement_all()
+
+        if T_k_index >= 1:
+            for i in range(T_k_index - 1, 0,-1):
+                u_counter = self.T[i].useful_bits[tagged_predictors_index_tag[i-1][0]]
+                if u_counter == 0:
+                    T_j_index = i
+                    break
+            else:
+                self.T[T_k_index].tags[tagged_predictors_index_tag[T_k_index-1][0]] = tagged_predictors_index_tag[T_k_index-1][1]
+                self.T[T_k_index].useful_bits[tagged_predictors_index_tag[T_k_index-1][0]] = 0
+                self.T[T_k_index].counters[tagged_predictors_index_tag[T_k_index-1][0]] = 4
+                
+            if T_j_index != 0:
+                rand_num = random.randint(1,3)
+                if rand_num == 3:
+                    self.T[T_j_index].tags[tagged_predictors_index_tag[T_j_index-1][0]] = tagged_predictors_index_tag[T_j_index-1][1]
+                    self.T[T_j_index].useful_bits[tagged_predictors_index_tag[T_j_index-1][0]] = 0
+                    self.T[T_j_index].counters[tagged_predictors_index_tag[T_j_index-1][0]] = 4
+
+                else:
+                        
+                    self.T[T_k_index].tags[tagged_predictors_index_tag[T_k_index-1][0]] = tagged_predictors_index_tag[T_k_index-1][1]
+                    self.T[T_k_index].useful_bits[tagged_predictors_index_tag[T_k_index-1][0]] = 0
+                    self.T[T_k_index].counters[tagged_predictors_index_tag[T_k_index-1][0]] = 4
+
+        return allocation_failed
 
-        tag_pc = get_from_bitrange([8+pc_off,0+pc_off], pc)
-        tag_R1 = binstr_get_from_bitrange([8,0], ghr_binstr)
-        tag_R2 = binstr_get_from_bitrange([7,0], ghr_binstr)
+    def age_useful_bits(self):
+        # Useful bits are LazyCounterTables, so this only records the aging;
+        # each entry picks it up on its next access
+        if self.msb_flip:
+            for tagged_component in self.T[1:]:
+                tagged_component.useful_bits.and_all(1)
+        else:
+            for tagged_component in self.T[1:]:
+                tagged_component.useful_bits.and_all(2)
 
-        for i in range(1, 2**(comp - 1)):
-            index_ghr ^= binstr_get_from_bitrange([(i+1)*10,i*10],ghr_binstr)
+        self.count = 0
+        self.msb_flip = not self.msb_flip
 
-        for i in range(1, math.floor( ( (2**(comp - 1) * 10) / 8) ) ):
-            tag_R1 ^= binstr_get_from_bitrange([(i+1)*8,i*8],ghr_binstr)
+    def index_tag_hash(self, pc, comp):
+        index_pc_low, index_pc_high, tag_pc = decode_pc_fields(pc, TAGE_PC_FIELDS)
+        index_pc = index_pc_low ^ index_pc_high
 
-        for i in range(1, math.floor( ( (2**(comp - 1) * 10) / 7) ) ):
-            tag_R2 ^= binstr_get_from_bitrange([(i+1)*7,i*7],ghr_binstr)
+        folded_index, folded_R1, folded_R2 = self.folded_histories[comp]
+        index_ghr = folded_index.value
+        tag_R1 = folded_R1.value
+        tag_R2 = folded_R2.value
 
         index = index_pc ^ index_ghr
         tag = tag_pc ^ tag_R1 ^ (tag_R2 << 1)
 
         return [index, tag]
 
+    def predict_batch(self, pcs, outcomes):
+        for pc, actual_branch in zip(batch_list(pcs), batch_list(outcomes)):
+            self.predict(pc, actual_branch)
+
+    def warm_batch(self, pcs, outcomes):
+        for pc, actual_branch in zip(batch_list(pcs), batch_list(outcomes)):
+            self.warm(pc, actual_branch)
+
     def get_method_type(self):
         return type(self).__name__.rstrip()
+
+PERCEPTRON_HISTORY_LENGTH = 32
+# Batches whose waves would average fewer branches than this are simulated
+# branch by branch on the precomputed histories instead
+PERCEPTRON_MIN_WAVE = 16
+
+class PerceptronPredictor(BranchPredictor):
+    # pht_size perceptrons selected by the low PC bits, each with a bias and
+    # one weight per global history bit. Weights are int8, or int16 when the
+    # training threshold needs more range; counter bits and init value are
+    # not used. Sparse tables are not used either.
+    def __init__(self, num_state_bits, init_state_val, pht_size, sparse=False,
+                 history_length=PERCEPTRON_HISTORY_LENGTH):
+        if np is None:
+            raise ImportError("the perceptron predictor requires NumPy")
+        self.pht_numbits = math.frexp(pht_size)[1] - 1
+        self.cut_pc = (self.pht_numbits, 0)
+        self.sparse = False
+        init_basic_vars(self, num_state_bits, init_state_val, pht_size)
+
+        self.history_length = history_length
+        self.threshold = int(1.93 * history_length + 14)
+        dtype = np.int8 if self.threshold < 127 else np.int16
+        self.weight_min = int(np.iinfo(dtype).min)
+        self.weight_max = int(np.iinfo(dtype).max)
+        self.weights = np.zeros((2**self.pht_numbits, history_length + 1), dtype=dtype)
+
+        # Bias input followed by the history as +1 taken / -1 not taken,
+        # newest first
+        self.history = np.full(history_length + 1, -1, dtype=np.int32)
+        self.history[0] = 1
+
+    def prediction_method(self, cutpc, actual_branch):
+        output = self.output(cutpc)
+        prediction = 1 if output >= 0 else 0
+
+        if prediction != actual_branch or abs(output) <= self.threshold:
+            self.train(cutpc, actual_branch)
+
+        self.history[2:] = self.history[1:-1]
+        self.history[1] = 1 if actual_branch else -1
+
+        return prediction
+
+    def output(self, index):
+        return int(np.dot(self.weights[index], self.history))
+
+    def train(self, index, actual_branch):
+        step = self.history if actual_branch else -self.history
+        self.weights[index] = np.clip(self.weights[index] + step, self.weight_min, self.weight_max)
+
+    def batch_histories(self, outcomes):
+        # Input vector of every branch of the batch, one row each
+        signs = outcomes.astype(np.int8) * 2 - 1
+        oldest_first = np.concatenate([self.history[:0:-1].astype(np.int8), signs])
+        windows = np.lib.stride_tricks.sliding_window_view(oldest_first, self.history_length)[:len(outcomes)]
+        inputs = np.ones((len(outcomes), self.history_length + 1), dtype=np.int8)
+        inputs[:, 1:] = windows[:, ::-1]
+        return inputs, oldest_first[-self.history_length:][::-1]
+
+    def predict_batch(self, pcs, outcomes):
+        pcs, outcomes = batch_arrays(pcs, outcomes)
+        if len(outcomes) == 0:
+            return
+        predictions = self.replay(pcs, outcomes)
+
+        good = int(np.count_nonzero(predictions == outcomes.astype(bool)))
+        self.good_predictions += good
+        self.mispredictions += len(outcomes) - good
+        if self.profile is not None:
+            self.profile.record_batch(pcs, predictions.astype(np.int8), outcomes)
+
+    def warm_batch(self, pcs, outcomes):
+        pcs, outcomes = batch_arrays(pcs, outcomes)
+        if len(outcomes):
+            self.replay(pcs, outcomes)
+
+    def replay(self, pcs, outcomes):
+        # Returns the prediction of every branch of a non-empty batch. The
+        # history only holds actual outcomes, so every input vector is known
+        # up front. The k-th use of each perceptron in the batch goes to
+        # wave k: a wave touches a perceptron at most once and only depends
+        # on earlier waves, so each is one vectorized step.
+        indices = batch_get_from_bitrange(self.cut_pc, pcs)
+        inputs, history = self.batch_histories(outcomes)
+        taken = outcomes.astype(bool)
+
+        order = np.argsort(indices, kind='stable')
+        sorted_indices = indices[order]
+        group_starts = np.flatnonzero(np.r_[True, sorted_indices[1:] != sorted_indices[:-1]])
+        group_sizes = np.diff(np.r_[group_starts, len(indices)])
+        ranks = np.arange(len(indices)) - np.repeat(group_starts, group_sizes)
+        wave_sizes = np.bincount(ranks)
+
+        if len(wave_sizes) * PERCEPTRON_MIN_WAVE > len(indices):
+            predictions = self.replay_inputs(indices, inputs, taken)
+        else:
+            predictions = self.replay_waves(indices, inputs, taken, order[np.argsort(ranks, kind='stable')],
+                                            wave_sizes)
+        self.history[1:] = history
+        return predictions
+
+    def replay_waves(self, indices, inputs, taken, wave_order, wave_sizes):
+        predictions = np.empty(len(indices), dtype=bool)
+        start = 0
+        for size in wave_sizes.tolist():
+            branches = wave_order[start:start + size]
+            start += size
+            rows = indices[branches]
+            wave_inputs = inputs[branches]
+            outputs = np.einsum('ij,ij->i', self.weights[rows], wave_inputs, dtype=np.int32)
+            predicted = outputs >= 0
+            predictions[branches] = predicted
+
+            wave_taken = taken[branches]
+            train = (predicted != wave_taken) | (np.abs(outputs) <= self.threshold)
+            if train.any():
+                rows = rows[train]
+                steps = wave_inputs[train].astype(np.int32) * np.where(wave_taken[train], 1, -1)[:, None]
+                self.weights[rows] = np.clip(self.weights[rows] + steps, self.weight_min, self.weight_max)
+        return predictions
+
+    def replay_inputs(self, indices, inputs, taken):
+        # Branch by branch, for batches dominated by a few perceptrons
+        predictions = np.empty(len(indices), dtype=bool)
+        weights = self.weights
+        for branch, (index, actual_branch) in enumerate(zip(indices.tolist(), taken.tolist())):
+            branch_inputs = inputs[branch].astype(np.int32)
+            output = int(np.dot(weights[index], branch_inputs))
+            predictions[branch] = output >= 0
+            if (output >= 0) != actual_branch or abs(output) <= self.threshold:
+                step = branch_inputs if actual_branch else -branch_inputs
+                weights[index] = np.clip(weights[index] + step, self.weight_min, self.weight_max)
+        return predictions
+
+    def can_replay_batch(self):
+        return True
+
+    def touched_entries(self):
+        return int(np.count_nonzero(self.weights.any(axis=1)))
+
+methods = {
+        'one-level':        OneLevel,
+        'two-level-global': TwoLevelGlobal,
+        'gshare':           GShare,
+        'two-level-local':  TwoLevelLocal,
+        'tournament':       TournamentPredictor,
+        'tage':             TAGEPredictor,
+        'perceptron':       PerceptronPredictor
+        }
+
+# Methods with a configurable history length
+history_methods = ['perceptron']
+
+def build_predictor(method, num_state_bits, init_state_val, pht_size, sparse=False, history_length=None):
+    if history_length is not None and method in history_methods:
+        return methods[method](num_state_bits, init_state_val, pht_size, sparse, history_length)
+    return methods[method](num_state_bits, init_state_val, pht_size, sparse)
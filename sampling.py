@@ -0,0 +1,110 @@
+import math
+import random
+import statistics
+
+from prediction_elements import *
+
+# Sampled simulation. Every period of the trace holds one warmup window of W
+# branches followed by one detailed window of D branches; everything else is
+# fast-forwarded. Fast-forwarding either keeps training the predictor
+# without counting the branches ('warm', functional warming) or skips them
+# entirely ('skip'), relying on the warmup window alone. Warmup windows and
+# warm fast-forwarding go through the predictors' warm entry points, which
+# update state only.
+
+# Two-sided 95% Student t quantiles for 1-29 degrees of freedom
+T_975 = [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+         2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+         2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045]
+
+FAST_FORWARD, WARMUP, DETAIL = range(3)
+
+def sample_schedule(period, warmup, detail, placement='fixed', seed=None):
+    # Endless (phase, start, end) segments covering the trace. 'fixed' puts
+    # the windows at the end of every period, 'random' at a random offset
+    # within it.
+    rng = random.Random(seed)
+    slack = period - warmup - detail
+    position = 0
+    while True:
+        offset = slack if placement == 'fixed' else rng.randint(0, slack)
+        for phase, length in ((FAST_FORWARD, offset), (WARMUP, warmup), (DETAIL, detail),
+                              (FAST_FORWARD, slack - offset)):
+            if length:
+                yield phase, position, position + length
+                position += length
+
+def feed(predictor, pcs, outcomes, engine):
+    if engine == 'numpy':
+        predictor.predict_batch(pcs, outcomes)
+    else:
+        for pc, branch in zip(batch_list(pcs), batch_list(outcomes)):
+            predictor.predict(pc, branch)
+
+def warm(predictor, pcs, outcomes, engine):
+    if engine == 'numpy':
+        predictor.warm_batch(pcs, outcomes)
+    else:
+        for pc, branch in zip(batch_list(pcs), batch_list(outcomes)):
+            predictor.warm(pc, branch)
+
+def counts(predictor):
+    return predictor.mispredictions, predictor.no_predictions, predictor.good_predictions
+
+def simulate_sampled(trace, predictor, period, warmup, detail, fast_forward='warm',
+                     placement='fixed', engine='python', seed=None):
+    # Returns the (mispredictions, no predictions, hits) of every detailed window
+    samples = []
+    schedule = sample_schedule(period, warmup, detail, placement, seed)
+    phase, start, end = next(schedule)
+    position = 0
+    for pcs, outcomes in trace.blocks():
+        block_start = position
+        position += len(pcs)
+        while start < position:
+            first = max(start, block_start) - block_start
+            last = min(end, position) - block_start
+            if phase == DETAIL:
+                before = counts(predictor)
+                feed(predictor, pcs[first:last], outcomes[first:last], engine)
+                window = [after - prior for after, prior in zip(counts(predictor), before)]
+                if samples and samples[-1][3] == start:
+                    # Detailed window split across trace blocks
+                    samples[-1][:3] = [total + part for total, part in zip(samples[-1][:3], window)]
+                else:
+                    samples.append(window + [start])
+            elif phase == WARMUP or fast_forward == 'warm':
+                warm(predictor, pcs[first:last], outcomes[first:last], engine)
+            if end > position:
+                break
+            phase, start, end = next(schedule)
+    return [tuple(sample[:3]) for sample in samples]
+
+def confidence_interval(values):
+    # Mean and 95% confidence half-width
+    mean = statistics.fmean(values)
+    if len(values) < 2:
+        return mean, float('nan')
+    quantile = T_975[len(values) - 2] if len(values) - 1 <= len(T_975) else 1.960
+    return mean, quantile * statistics.stdev(values) / math.sqrt(len(values))
+
+def sample_stats(predictor, samples):
+    # get_stats() of the detailed windows combined, plus per-window estimates
+    stats = stats_from_counts(predictor.get_method_type(), predictor.num_state_bits, predictor.init_state_val,
+                              predictor.pht_size, sum(sample[0] for sample in samples),
+                              sum(sample[1] for sample in samples), sum(sample[2] for sample in samples))
+    mpki = [(mis + none) / (mis + none + hit) * 1000 for mis, none, hit in samples if mis + none + hit]
+    hit_rate = [hit / (mis + none + hit) * 100 for mis, none, hit in samples if mis + none + hit]
+    stats['samples'] = len(mpki)
+    if mpki:
+        stats['mpki_mean'], stats['mpki_ci95'] = confidence_interval(mpki)
+        stats['hit_rate_mean'], stats['hit_rate_ci95'] = confidence_interval(hit_rate)
+    return stats
+
+def print_sample_stats(stats):
+    print_stats_summary(stats)
+    print("Samples:\t\t", stats['samples'])
+    if stats['samples']:
+        print("MP/KI estimate:\t\t", '{0:.04f} +/- {1:.04f}'.format(stats['mpki_mean'], stats['mpki_ci95']), "(95% CI)")
+        print("Hit rate estimate:\t", '{0:.04f} +/- {1:.04f} %'.format(stats['hit_rate_mean'], stats['hit_rate_ci95']), "(95% CI)")
+    print()
@@ -0,0 +1,74 @@
+#!/usr/bin/python3
+
+import sys
+import json
+import asyncio
+import argparse
+
+class SimulationClient:
+    # JSON-lines client for sim_server.py
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.next_id = 0
+
+    @classmethod
+    async def connect(cls, path):
+        reader, writer = await asyncio.open_unix_connection(path)
+        return cls(reader, writer)
+
+    async def request(self, op, **fields):
+        self.next_id += 1
+        message = dict(fields, op=op, id=self.next_id)
+        self.writer.write(json.dumps(message).encode() + b"\n")
+        await self.writer.drain()
+        return json.loads(await self.reader.readline())
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+async def submit(args):
+    client = await SimulationClient.connect(args.socket)
+    responses = []
+    try:
+        if args.config is not None:
+            responses.append(await client.request('open', session=args.session, config=args.config,
+                                                  sparse=args.sparse))
+        for index, path in enumerate(args.traces):
+            fields = {'session': args.session, 'trace': path, 'reset': args.reset_each or (index == 0 and args.reset)}
+            if args.seed is not None:
+                fields['seed'] = args.seed
+            responses.append(await client.request('run', **fields))
+        if args.close:
+            responses.append(await client.request('close', session=args.session))
+        if args.shutdown:
+            responses.append(await client.request('shutdown'))
+    finally:
+        await client.close()
+    return responses
+
+def main():
+    parser = argparse.ArgumentParser(description="Submit traces to a running sim_server.py")
+    parser.add_argument("traces", help="Trace files to simulate, in order",nargs='*')
+    parser.add_argument("-socket", help="Unix socket path",default="branch_predictor.sock",required=False)
+    parser.add_argument("-session", help="Session name",default="default",required=False)
+    parser.add_argument("-config", help="Open the session with this method:phtsize[:cbits[:cinit]] first",
+            required=False)
+    parser.add_argument("-sparse", help="Open the session with sparse tables",action='store_true',required=False)
+    parser.add_argument("-reset", help="Reset the session before the first trace",action='store_true',required=False)
+    parser.add_argument("-reset-each", help="Reset the session before every trace",dest='reset_each',
+            action='store_true',required=False)
+    parser.add_argument("-seed", help="Seed the random module before each trace",type=int,required=False)
+    parser.add_argument("-close", help="Close the session afterwards",action='store_true',required=False)
+    parser.add_argument("-shutdown", help="Stop the server afterwards",action='store_true',required=False)
+    args = parser.parse_args()
+
+    responses = asyncio.run(submit(args))
+    for response in responses:
+        print(json.dumps(response))
+    if not all(response['ok'] for response in responses):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
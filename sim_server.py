@@ -0,0 +1,249 @@
+#!/usr/bin/python3
+
+import os
+import json
+import time
+import stat
+import random
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from predictors import build_predictor
+from prediction_elements import get_stats, reset_stats, norm_branch
+from trace_io import open_trace, np
+from checkpoint import snapshot, restore
+from branch_predictor import parse_config
+
+# Long-lived simulation server on a Unix socket. Clients send one JSON
+# request per line and get one JSON response per line, with the request's
+# "id" echoed back:
+#
+#   {"op": "open", "session": S, "config": "method:phtsize[:cbits[:cinit]]", "sparse": false,
+#    "history_length": N}
+#   {"op": "run", "session": S, "trace": PATH}              simulate a trace file
+#   {"op": "run", "session": S, "records": [[pc, 1], ...]}  simulate records sent inline
+#   {"op": "reset", "session": S}                           back to the state after open
+#   {"op": "close", "session": S}
+#   {"op": "list"} / {"op": "shutdown"}
+#
+# A session keeps its predictor between runs, so state carries over unless
+# "reset": true is given with a run. Each run reports the stats of its own
+# branches. Runs execute in a worker thread; with the default single worker
+# they are serialized, which keeps TAGE's draws from the shared random
+# module reproducible ("seed" reseeds it before a run). Resetting a session
+# leaves the random module alone, as other sessions draw from it too.
+#
+# Every request is answered; failures come back as {"ok": false, "error": ...}.
+
+MESSAGE_LIMIT = 64 * 1024 * 1024
+
+class Session:
+    def __init__(self, config, sparse=False, history_length=None):
+        self.config = config
+        self.sparse = sparse
+        self.predictor = build_predictor(*config, sparse=sparse, history_length=history_length)
+        self.pristine = snapshot(self.predictor)
+        self.lock = asyncio.Lock()
+        self.runs = 0
+
+    def reset(self):
+        self.predictor, _ = restore(self.pristine, restore_random=False)
+
+    def run_trace(self, path, engine):
+        bp = self.predictor
+        with open_trace(path) as trace:
+            if engine == 'numpy':
+                for pcs, outcomes in trace.blocks():
+                    bp.predict_batch(pcs, outcomes)
+            else:
+                for pc, branch in trace:
+                    bp.predict(pc, branch)
+
+    def run_records(self, records):
+        bp = self.predictor
+        for pc, branch in parse_records(records):
+            bp.predict(pc, branch)
+
+    def run(self, message, engine):
+        if message.get('reset'):
+            self.reset()
+        if 'seed' in message:
+            random.seed(message['seed'])
+        reset_stats(self.predictor)
+
+        start = time.perf_counter()
+        if 'trace' in message:
+            self.run_trace(message['trace'], engine)
+        elif 'records' in message:
+            self.run_records(message['records'])
+        else:
+            raise ValueError("run needs a trace or records")
+        self.runs += 1
+
+        stats = get_stats(self.predictor)
+        stats['seconds'] = time.perf_counter() - start
+        return stats
+
+class SimulationServer:
+    def __init__(self, engine='python', workers=1):
+        self.engine = engine
+        self.sessions = {}
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.stopped = None
+        self.clients = {}
+
+    def session(self, message):
+        name = message.get('session')
+        if name not in self.sessions:
+            raise ValueError("no session '{}'".format(name))
+        return self.sessions[name]
+
+    async def dispatch(self, message):
+        op = message.get('op')
+        loop = asyncio.get_running_loop()
+
+        if op == 'open':
+            if not isinstance(message.get('config'), str):
+                raise ValueError("open needs a config string method:phtsize[:cbits[:cinit]]")
+            config = parse_config(message['config'])
+            existing = self.sessions.get(message['session'])
+            if existing is not None and existing.config == config and not message.get('replace'):
+                return {'created': False}
+            if existing is not None and not message.get('replace'):
+                raise ValueError("session '{}' is open with another configuration".format(message['session']))
+            self.sessions[message['session']] = await loop.run_in_executor(
+                    self.executor, Session, config, message.get('sparse', False),
+                    message.get('history_length'))
+            return {'created': True}
+
+        if op == 'run':
+            session = self.session(message)
+            async with session.lock:
+                stats = await loop.run_in_executor(self.executor, session.run, message, self.engine)
+            return {'stats': stats}
+
+        if op == 'reset':
+            session = self.session(message)
+            async with session.lock:
+                await loop.run_in_executor(self.executor, session.reset)
+            return {}
+
+        if op == 'close':
+            self.session(message)
+            del self.sessions[message['session']]
+            return {}
+
+        if op == 'list':
+            return {'sessions': {name: {'config': config_name(session.config), 'runs': session.runs}
+                                 for name, session in self.sessions.items()}}
+
+        if op == 'shutdown':
+            self.stopped.set()
+            return {}
+
+        raise ValueError("unknown op '{}'".format(op))
+
+    async def handle_client(self, reader, writer):
+        self.clients[asyncio.current_task()] = writer
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                message = {}
+                try:
+                    message = json.loads(line)
+                    if not isinstance(message, dict):
+                        raise ValueError("requests are JSON objects")
+                    response = await self.dispatch(message)
+                    response['ok'] = True
+                except Exception as error:
+                    response = {'ok': False, 'error': "{}: {}".format(type(error).__name__, error)}
+                if 'id' in message:
+                    response['id'] = message['id']
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.LimitOverrunError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+            del self.clients[asyncio.current_task()]
+
+    async def serve(self, path):
+        self.stopped = asyncio.Event()
+        server = await asyncio.start_unix_server(self.handle_client, path, limit=MESSAGE_LIMIT)
+        async with server:
+            await self.stopped.wait()
+            # Connected clients see end of file and their handlers finish
+            # after answering the request in flight
+            server.close()
+            for writer in list(self.clients.values()):
+                writer.close()
+            await asyncio.gather(*self.clients, return_exceptions=True)
+        self.executor.shutdown()
+
+def parse_records(records):
+    # [[pc, outcome], ...] with a non-negative integer (or decimal string) PC
+    # and an outcome of 0/1 or "T"/"N"
+    if not isinstance(records, list):
+        raise ValueError("records must be a list of [pc, outcome] pairs")
+    parsed = []
+    for record in records:
+        if not isinstance(record, list) or len(record) != 2:
+            raise ValueError("bad record {!r}: expected [pc, outcome]".format(record))
+        pc, branch = record
+        if isinstance(pc, str) and pc.isdigit():
+            pc = int(pc)
+        if not isinstance(pc, int) or isinstance(pc, bool) or not 0 <= pc < 2**64:
+            raise ValueError("bad PC in record {!r}".format(record))
+        if branch in (0, 1) and not isinstance(branch, float):
+            branch = int(branch)
+        elif branch in ('T', 'N'):
+            branch = norm_branch(branch)
+        else:
+            raise ValueError("bad outcome in record {!r}: expected 0, 1, 'T' or 'N'".format(record))
+        parsed.append((pc, branch))
+    return parsed
+
+def config_name(config):
+    # parse_config's method, cbits, cinit, phtsize back to method:phtsize:cbits:cinit
+    method, num_state_bits, init_state_val, pht_size = config
+    return "{}:{}:{}:{}".format(method, pht_size, num_state_bits, init_state_val)
+
+def remove_stale_socket(path):
+    try:
+        if stat.S_ISSOCK(os.stat(path).st_mode):
+            os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve predictor sessions on a Unix socket")
+    parser.add_argument("-socket", help="Unix socket path",default="branch_predictor.sock",required=False)
+    parser.add_argument("-preload", help="Open a session named after each configuration method:phtsize[:cbits[:cinit]]",
+            nargs='+',type=parse_config,default=[],required=False)
+    parser.add_argument("-sparse", help="Preloaded sessions allocate PHT entries on first write",
+            action='store_true',required=False)
+    parser.add_argument("-engine", help="Simulation engine for trace files",choices=['python', 'numpy'],
+            default='python',required=False)
+    parser.add_argument("-workers", help="Runs executed at the same time",default=1,type=int,required=False)
+    args = parser.parse_args()
+    if args.engine == 'numpy' and np is None:
+        parser.error("-engine numpy requires NumPy")
+
+    server = SimulationServer(args.engine, args.workers)
+    for config in args.preload:
+        server.sessions[config_name(config)] = Session(config, args.sparse)
+
+    remove_stale_socket(args.socket)
+    print("Serving", len(server.sessions), "session(s) on", args.socket)
+    try:
+        asyncio.run(server.serve(args.socket))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        remove_stale_socket(args.socket)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/python3
+
+import os
+import csv
+import json
+import argparse
+import itertools
+
+from predictors import methods
+from prediction_elements import *
+from parallel import run_pool
+from trace_io import SharedTrace, np
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate every combination of the given parameters in parallel")
+    parser.add_argument("-methods", help="Prediction methods",nargs='+',choices=list(methods),required=True)
+    parser.add_argument("-cbits", help="Counter bit widths",nargs='+',default=[2],type=int,required=False)
+    parser.add_argument("-cinit", help="Initial counter values",nargs='+',default=[0],type=int,required=False)
+    parser.add_argument("-phtsize", help="Pattern history table sizes",nargs='+',type=int,required=True)
+    parser.add_argument("-trace", help="Input trace file: text (optionally .gz/.xz/.bz2) or packed binary",required=True)
+    parser.add_argument("-jobs", help="Worker processes",default=os.cpu_count(),type=int,required=False)
+    parser.add_argument("-engine", help="Simulation engine",choices=['python', 'numpy'],default='python',required=False)
+    parser.add_argument("-sparse", help="Allocate pattern history table entries on first write",action='store_true',required=False)
+    parser.add_argument("-histlen", help="Global history length of the perceptron predictor",type=int,required=False)
+    parser.add_argument("-seed", help="Seed for TAGE's random replacement",type=int,required=False)
+    parser.add_argument("-csv", help="Write the results to this CSV file",required=False)
+    parser.add_argument("-json", help="Write the results to this JSON file",required=False)
+    args = parser.parse_args()
+    if args.engine == 'numpy' and np is None:
+        parser.error("-engine numpy requires NumPy")
+    if np is None and 'perceptron' in args.methods:
+        parser.error("the perceptron predictor requires NumPy")
+
+    configs = list(itertools.product(args.methods, args.cbits, args.cinit, args.phtsize))
+
+    print("Loading trace...\n")
+    with SharedTrace.create(args.trace) as trace:
+        print("Simulating", len(configs), "configurations on", len(trace), "branches...\n")
+        results = run_pool(trace, [(config, 0, len(trace), 0, args.engine, args.seed, args.sparse, args.histlen)
+                                   for config in configs],
+                           args.jobs)
+
+    results.sort(key=lambda stats: (stats['method'], stats['counter_bits'],
+                                    stats['counter_init'], stats['pht_entries']))
+    print_stats_table(results)
+
+    if args.csv is not None:
+        with open(args.csv, 'w', newline='') as csv_file:
+            # Only sparse predictors report touched entries, so the columns
+            # are the union of all result keys
+            fieldnames = []
+            for stats in results:
+                fieldnames += [key for key in stats if key not in fieldnames]
+            writer = csv.DictWriter(csv_file, fieldnames=fieldnames, restval='')
+            writer.writeheader()
+            writer.writerows(results)
+    if args.json is not None:
+        with open(args.json, 'w') as json_file:
+            json.dump(results, json_file, indent=4)
+
+if __name__ == "__main__":
+    main()
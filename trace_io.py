@@ -0,0 +1,383 @@
+import io
+import os
+import sys
+import bz2
+import gzip
+import lzma
+import mmap
+import struct
+import tempfile
+from array import array
+from itertools import islice
+from multiprocessing import shared_memory
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from prediction_elements import norm_branch
+
+# Packed binary trace layout:
+#
+#   header:  magic (8 bytes) | block size (uint64) | record count (uint64)
+#   blocks:  block size x uint64 PC | block size / 8 bytes of outcome bits
+#
+# Everything is little-endian. Outcome bits are packed LSB first, so record i
+# of a block is bit (i % 8) of byte (i // 8). Every block but the last is
+# full, which keeps every block at the same offset and lets a reader map any
+# block straight out of the file without parsing. The last block holds only
+# its records, with its outcome bits zero padded to a whole byte; traces
+# written by earlier versions pad it to a full block, and still read.
+BINARY_MAGIC = b"BPTRACE1"
+BINARY_HEADER = struct.Struct("<8sQQ")
+BINARY_BLOCK_SIZE = 64 * 1024
+
+# Leading bytes of the compressed containers a text trace may come in
+COMPRESSED_FORMATS = [
+        (b"\x1f\x8b",            gzip.open),
+        (b"\xfd7zXZ\x00",        lzma.open),
+        (b"BZh",                 bz2.open)
+        ]
+
+# Outcome bits of every possible byte, LSB first
+_BYTE_BITS = [tuple((byte >> bit) & 1 for bit in range(8)) for byte in range(256)]
+
+def block_bytes(count):
+    return count * 8 + -(-count // 8)
+
+def is_binary_trace(path):
+    if path == '-':
+        return False
+    with open(path, 'rb') as trace:
+        return trace.read(len(BINARY_MAGIC)) == BINARY_MAGIC
+
+def open_trace(path):
+    # '-' reads a text trace from stdin
+    if is_binary_trace(path):
+        return BinaryTrace(path)
+    return TextTrace(path)
+
+def decompressing_stream(raw):
+    head = raw.peek(8)
+    for magic, container in COMPRESSED_FORMATS:
+        if head.startswith(magic):
+            return container(raw)
+    if head.startswith(BINARY_MAGIC):
+        raise ValueError("binary traces must be given as an uncompressed file path")
+    return raw
+
+class TextTrace:
+    # Streams "<pc> <T|N>" lines from a file, a gzip/xz/bz2 compressed file or
+    # stdin without holding more than a read buffer in memory
+    def __init__(self, path):
+        self.path = path
+        if path == '-':
+            self.raw = sys.stdin.buffer
+            self.total_bytes = None
+        else:
+            self.raw = open(path, 'rb')
+            self.total_bytes = os.fstat(self.raw.fileno()).st_size
+        self.stream = io.TextIOWrapper(decompressing_stream(self.raw))
+
+    def progress(self):
+        # Fraction of the (possibly compressed) input consumed so far, or None
+        # when the size is unknown
+        if not self.total_bytes:
+            return None
+        return self.raw.tell() / self.total_bytes
+
+    def __iter__(self):
+        for request in self.stream:
+            pc, branch = request.split(" ")
+            yield pc, norm_branch(branch)
+
+    def skip(self, count):
+        # Discards the next count records
+        for request in islice(self.stream, count):
+            pass
+
+    def blocks(self, block_size=BINARY_BLOCK_SIZE):
+        # Same (pcs, outcomes) blocks as BinaryTrace.blocks
+        records = iter(self)
+        while True:
+            block = list(islice(records, block_size))
+            if not block:
+                return
+            pcs = [int(pc) for pc, branch in block]
+            outcomes = [branch for pc, branch in block]
+            if np is not None:
+                yield np.array(pcs, dtype=np.uint64), np.array(outcomes, dtype=np.uint8)
+            else:
+                yield pcs, outcomes
+
+    def close(self):
+        if self.raw is sys.stdin.buffer:
+            return
+        self.stream.close()
+        self.raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class BinaryTrace:
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.block_size, self.length = BINARY_HEADER.unpack_from(self.map, 0)
+        if magic != BINARY_MAGIC:
+            raise ValueError("{} is not a binary trace".format(path))
+        if self.block_size == 0 or self.block_size % 8 != 0:
+            raise ValueError("{}: bad block size {}".format(path, self.block_size))
+
+        self.stride = block_bytes(self.block_size)
+        self.num_blocks = -(-self.length // self.block_size)
+        # Record slots of the last block
+        self.last_slots = self.block_records(self.num_blocks - 1) if self.num_blocks else 0
+        size = len(self.map) - BINARY_HEADER.size
+        if size >= self.num_blocks * self.stride:
+            self.last_slots = self.block_size
+        elif size < (self.num_blocks - 1) * self.stride + block_bytes(self.last_slots):
+            raise ValueError("{}: truncated binary trace".format(path))
+        self.start = 0
+        self.position = 0
+
+    def __len__(self):
+        return self.length
+
+    def progress(self):
+        return self.position / self.length if self.length else None
+
+    def block_records(self, block):
+        return min(self.block_size, self.length - block * self.block_size)
+
+    def raw_block(self, block):
+        # Zero-copy views of the PC words and the packed outcome bytes
+        slots = self.last_slots if block == self.num_blocks - 1 else self.block_size
+        start = BINARY_HEADER.size + block * self.stride
+        bits_start = start + slots * 8
+        view = memoryview(self.map)
+        return view[start:bits_start], view[bits_start:bits_start + -(-slots // 8)]
+
+    def skip(self, count):
+        # Iteration starts count records further on; nothing is read
+        self.start = min(self.length, self.start + count)
+        self.position = self.start
+
+    def blocks(self):
+        # Yields (pcs, outcomes) per block. With NumPy these are uint64/uint8
+        # arrays; the PC array is a view straight into the mapped file.
+        for block in range(self.start // self.block_size, self.num_blocks):
+            count = self.block_records(block)
+            first = max(0, self.start - block * self.block_size)
+            pc_bytes, bit_bytes = self.raw_block(block)
+            self.position = block * self.block_size + first
+            if np is not None:
+                pcs = np.frombuffer(pc_bytes, dtype='<u8', count=count)
+                outcomes = np.unpackbits(np.frombuffer(bit_bytes, dtype=np.uint8),
+                                         count=count, bitorder='little')
+            else:
+                pcs = self._pc_list(pc_bytes, count)
+                outcomes = self._outcome_list(bit_bytes, count)
+            yield pcs[first:], outcomes[first:]
+
+    def __iter__(self):
+        for block in range(self.start // self.block_size, self.num_blocks):
+            count = self.block_records(block)
+            first = max(0, self.start - block * self.block_size)
+            pc_bytes, bit_bytes = self.raw_block(block)
+            self.position = block * self.block_size + first
+            pcs = self._pc_list(pc_bytes, count)
+            outcomes = self._outcome_list(bit_bytes, count)
+            if first:
+                pcs = pcs[first:]
+                outcomes = outcomes[first:]
+            yield from zip(pcs, outcomes)
+
+    def _pc_list(self, pc_bytes, count):
+        if sys.byteorder == 'little':
+            return pc_bytes.cast('Q')[:count].tolist()
+        pcs = array('Q', pc_bytes[:count * 8])
+        pcs.byteswap()
+        return pcs.tolist()
+
+    def _outcome_list(self, bit_bytes, count):
+        return [bit for byte in bit_bytes for bit in _BYTE_BITS[byte]][:count]
+
+    def close(self):
+        if self.map is None:
+            return
+        try:
+            self.map.close()
+        except BufferError:
+            # Block views handed out by blocks() are still alive; the
+            # mapping is released when the last of them is collected
+            pass
+        self.file.close()
+        self.map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class SharedTrace:
+    # A fully decoded trace in a shared memory segment, laid out as count x
+    # uint64 PC followed by count x uint8 outcome. The creating process owns
+    # and unlinks the segment; pool workers attach to it by name. The
+    # segment is sized up front and filled a block at a time, so creating
+    # it takes no other memory of the size of the trace.
+    def __init__(self, shm, count, owner):
+        self.shm = shm
+        self.count = count
+        self.owner = owner
+        if np is not None:
+            self.pcs = np.ndarray((count,), dtype=np.uint64, buffer=shm.buf)
+            self.outcomes = np.ndarray((count,), dtype=np.uint8, buffer=shm.buf, offset=count * 8)
+        else:
+            self.pcs = shm.buf[:count * 8].cast('Q')
+            self.outcomes = shm.buf[count * 8:count * 9]
+
+    @classmethod
+    def create(cls, path):
+        # The length of a text trace is only known once it has been read, so
+        # it is packed into a temporary binary trace first
+        if is_binary_trace(path):
+            return cls.from_binary(path)
+        handle, binary_path = tempfile.mkstemp(suffix='.bin')
+        os.close(handle)
+        try:
+            convert_text_to_binary(path, binary_path)
+            return cls.from_binary(binary_path)
+        finally:
+            os.unlink(binary_path)
+
+    @classmethod
+    def from_binary(cls, path):
+        with BinaryTrace(path) as trace:
+            count = len(trace)
+            shared = cls(shared_memory.SharedMemory(create=True, size=max(count * 9, 1)), count, True)
+            position = 0
+            for block_pcs, block_outcomes in trace.blocks():
+                end = position + len(block_pcs)
+                if np is None:
+                    block_pcs = array('Q', block_pcs)
+                    block_outcomes = bytes(block_outcomes)
+                shared.pcs[position:end] = block_pcs
+                shared.outcomes[position:end] = block_outcomes
+                position = end
+        return shared
+
+    @classmethod
+    def attach(cls, name, count):
+        # Pool workers share the parent's resource tracker, so attaching does
+        # not hand ownership of the segment to them
+        return cls(shared_memory.SharedMemory(name=name), count, False)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        self.pcs = self.outcomes = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class BinaryTraceWriter:
+    def __init__(self, path, block_size=BINARY_BLOCK_SIZE):
+        if block_size == 0 or block_size % 8 != 0:
+            raise ValueError("block size must be a non-zero multiple of 8")
+        self.block_size = block_size
+        self.file = open(path, 'wb')
+        self.file.write(BINARY_HEADER.pack(BINARY_MAGIC, block_size, 0))
+        self.length = 0
+        self.pcs = array('Q')
+        self.outcomes = bytearray()
+
+    def write(self, pc, branch):
+        self.pcs.append(int(pc))
+        self.outcomes.append(1 if branch else 0)
+        if len(self.pcs) == self.block_size:
+            self.flush_block()
+
+    def flush_block(self):
+        count = len(self.pcs)
+        if count == 0:
+            return
+        # Only a last, short block gets here with count < block_size
+        self.outcomes.extend(bytes(-count % 8))
+        if sys.byteorder != 'little':
+            self.pcs.byteswap()
+
+        self.file.write(self.pcs.tobytes())
+        self.file.write(pack_outcomes(self.outcomes))
+
+        self.length += count
+        self.pcs = array('Q')
+        self.outcomes = bytearray()
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.flush_block()
+        self.file.seek(0)
+        self.file.write(BINARY_HEADER.pack(BINARY_MAGIC, self.block_size, self.length))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class TextTraceWriter:
+    # Writes "<pc> <T|N>" lines, the same interface as BinaryTraceWriter
+    def __init__(self, path):
+        self.file = open(path, 'w')
+        self.length = 0
+
+    def write(self, pc, branch):
+        self.file.write("{} {}\n".format(pc, 'T' if branch else 'N'))
+        self.length += 1
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def pack_outcomes(outcomes):
+    if np is not None:
+        return np.packbits(np.frombuffer(outcomes, dtype=np.uint8), bitorder='little').tobytes()
+    packed = bytearray(len(outcomes) // 8)
+    for index in range(len(packed)):
+        byte = 0
+        for bit, outcome in enumerate(outcomes[index * 8:index * 8 + 8]):
+            byte |= outcome << bit
+        packed[index] = byte
+    return bytes(packed)
+
+def convert_text_to_binary(text_path, binary_path, block_size=BINARY_BLOCK_SIZE):
+    with TextTrace(text_path) as trace, BinaryTraceWriter(binary_path, block_size) as writer:
+        for pc, branch in trace:
+            writer.write(pc, branch)
+    return writer.length